@@ -0,0 +1,393 @@
+"""Local stand-in for the Nixplay web app, used by "nix-upload.py bench" (see nix_upload_bench.py).
+
+Only the standard library is needed; nothing here talks to nixplay.com.
+"""
+import json
+import logging
+import random
+import re
+import threading
+import time
+import email.parser
+import email.policy
+import urllib.parse
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Upload endpoint of FakeNixplayServer, for benchmarking the "http" transport; {base_url} and {playlist_id}
+# are filled in. The endpoint of nixplay.com is not known, so real runs need http_upload_url in config.json.
+FAKE_HTTP_UPLOAD_URL = "{base_url}/api/playlists/{playlist_id}/photos/"
+
+# Pages of FakeNixplayServer. They carry the same element ids, classes and texts the script looks for on
+# the real site; the markup around them is kept to the minimum.
+FAKE_LOGIN_HTML = """<!DOCTYPE html>
+<html><head><title>Nixplay - Sign in</title></head>
+<body>
+<form method="post" action="/login">
+  <input id="login_username" name="username" type="text">
+  <input id="login_password" name="password" type="password">
+  <button id="nixplay_login_btn" type="submit">Sign in</button>
+</form>
+%(message)s
+</body></html>
+"""
+
+FAKE_APP_HTML = """<!DOCTYPE html>
+<html><head><title>Nixplay</title>
+<style>
+  @font-face { font-family: NixSans; src: url('/static/nix-sans.woff2') format('woff2'); }
+  body { font-family: NixSans, sans-serif; }
+  .hidden { display: none; }
+  .nix-upload-modal-bg { position: fixed; top: 40%%; left: 30%%; padding: 20px; background: #eee; }
+  .photo-item { display: inline-block; width: 80px; height: 60px; margin: 2px; background: #ccc; overflow: hidden; }
+</style></head>
+<body>
+<div id="view"></div>
+<div id="modal" class="hidden"><span class="nix-modal-title-text"></span> <span id="modal-buttons"></span></div>
+<div id="upload-modal" class="nix-upload-modal-bg hidden"><span id="upload-progress"></span></div>
+<input id="upload" type="file" multiple class="hidden">
+<script>
+var LINGER_MS = %(linger_ms)d;
+var playlist = null, completed = 0, total = 0, active = 0;
+
+function $(id) { return document.getElementById(id); }
+
+function escape(text) {
+  var div = document.createElement('div');
+  div.textContent = text;
+  return div.innerHTML.replace(/"/g, '&quot;');
+}
+
+function api(method, url, body) {
+  return fetch(url, {method: method, credentials: 'same-origin', body: body ? JSON.stringify(body) : undefined})
+    .then(function (response) {
+      if (response.status === 403) { location.href = '/login'; }
+      return response.json();
+    });
+}
+
+function route() {
+  var match = location.hash.match(/^#\\/playlist\\/(\\d+)/);
+  $('modal').className = 'hidden';
+  if (match) { showPlaylist(match[1]); } else { showPlaylists(); }
+}
+
+function showPlaylists() {
+  playlist = null;
+  api('GET', '/api/playlists').then(function (playlists) {
+    $('view').innerHTML = playlists.map(function (p, index) {
+      return '<div id="playlist-' + (index + 1) + '" class="playlist"><div class="playlist-draggable-wrapper" data-id="' + p.id + '">'
+        + '<span class="name" title="' + escape(p.name) + '">' + escape(p.name) + '</span> (' + p.count + ')</div></div>';
+    }).join('');
+    Array.prototype.forEach.call(document.querySelectorAll('.playlist-draggable-wrapper'), function (el) {
+      el.onclick = function () { location.hash = '#/playlist/' + el.getAttribute('data-id'); };
+    });
+  });
+}
+
+function photoItem(name) {
+  return '<div class="photo-item" title="' + escape(name) + '"><input type="checkbox" class="photo-select">'
+    + '<img src="/thumbnails/' + playlist + '/' + encodeURIComponent(name) + '" width="80" height="45"></div>';
+}
+
+function showPlaylist(id) {
+  playlist = id;
+  // Opening a playlist starts a new upload session (the page is not reloaded between hash routes)
+  if (!active) { completed = total = 0; }
+  api('GET', '/api/playlists/' + id).then(function (p) {
+    $('view').innerHTML = '<h2>' + escape(p.name) + '</h2>'
+      + '<button id="add-photos">Add photos</button> '
+      + '<span id="add-menu" class="hidden"><span>From my computer</span></span> '
+      + '<button class="btn dropdown-toggle btn-gray">Actions</button>'
+      + '<span id="actions-menu" class="hidden">'
+      + ' <a href="" ng-click="deleteSelectedSlides()">Delete selected photos</a>'
+      + ' <a href="" ng-click="deleteAllSlides(\\'delete\\')">Permanent delete all photos</a></span>'
+      + '<div id="photos">' + p.photos.map(photoItem).join('') + '</div>';
+    $('add-photos').onclick = function () { $('add-menu').className = ''; };
+    $('add-menu').onclick = function () { $('add-menu').className = 'hidden'; };
+    document.querySelector('.dropdown-toggle').onclick = function () {
+      $('actions-menu').className = $('actions-menu').className ? '' : 'hidden';
+    };
+    Array.prototype.forEach.call(document.querySelectorAll('#actions-menu a'), function (a) {
+      a.onclick = function (event) {
+        event.preventDefault();
+        $('actions-menu').className = 'hidden';
+        if (a.getAttribute('ng-click').indexOf('deleteAllSlides') >= 0) { confirmDelete(null); } else { confirmDelete(selectedNames()); }
+      };
+    });
+  });
+}
+
+function selectedNames() {
+  return Array.prototype.filter.call(document.querySelectorAll('.photo-item'), function (item) {
+    return item.querySelector('.photo-select').checked;
+  }).map(function (item) { return item.getAttribute('title'); });
+}
+
+function showModal(title, buttons) {
+  document.querySelector('.nix-modal-title-text').textContent = title;
+  $('modal-buttons').innerHTML = buttons.map(function (b) { return '<button>' + b[0] + '</button>'; }).join(' ');
+  Array.prototype.forEach.call($('modal-buttons').children, function (button, i) {
+    button.onclick = function () { $('modal').className = 'hidden'; buttons[i][1](); };
+  });
+  $('modal').className = '';
+}
+
+function confirmDelete(names) {
+  if (!document.querySelector('.photo-item') || (names && !names.length)) {
+    showModal('No Photo in Playlist', [['OK', function () {}]]);
+    return;
+  }
+  showModal(names ? 'Delete ' + names.length + ' selected photos?' : 'Delete all photos?', [
+    ['Yes', function () { api('POST', '/api/playlists/' + playlist + '/delete', names ? {names: names} : {all: true}).then(route); }],
+    ['No', function () {}]
+  ]);
+}
+
+function showProgress() {
+  $('upload-progress').textContent = completed + ' of ' + total + ' files completed';
+}
+
+function send(id, file) {
+  var form = new FormData();
+  form.append('file', file, file.name);
+  active++;
+  return fetch('/api/playlists/' + id + '/photos/', {method: 'POST', body: form, credentials: 'same-origin'})
+    .then(function (response) {
+      if (!response.ok) { return; }
+      completed++;
+      if (playlist === id) { $('photos').insertAdjacentHTML('beforeend', photoItem(file.name)); }
+    }, function () {})
+    .then(function () {
+      active--;
+      showProgress();
+      if (!active) {
+        // Like the real uploader, the progress dialog closes a moment after the last file
+        setTimeout(function () {
+          if (active) { return; }
+          $('upload-progress').textContent = '';
+          $('upload-modal').className = 'nix-upload-modal-bg hidden';
+        }, LINGER_MS);
+      }
+    });
+}
+
+$('upload').onchange = function () {
+  var files = Array.prototype.slice.call($('upload').files), id = playlist, queue = files.slice();
+  $('upload').value = '';
+  total += files.length;
+  showProgress();
+  $('upload-modal').className = 'nix-upload-modal-bg';
+  // Three files at a time, like the site's uploader
+  function next() {
+    var file = queue.shift();
+    if (file) { return send(id, file).then(next); }
+  }
+  for (var i = 0; i < 3; i++) { next(); }
+};
+
+window.onhashchange = route;
+route();
+</script>
+</body></html>
+"""
+
+
+class FakeNixplayServer:
+    """Local stand-in for the Nixplay web app, for exercising the script without the real site.
+
+    Serves a login page and a small playlist app with the same DOM hooks as nixplay.com (login form,
+    playlists, Add photos / From my computer, the "files completed" counter, the Actions menu and the
+    delete modals), and accepts multipart photo uploads on the path of FAKE_HTTP_UPLOAD_URL. Uploads
+    are recorded in self.uploads as (playlist_id, file_name, size).
+
+    bandwidth_mbps caps the combined upload speed, latency (seconds) delays every request, and
+    failure_rate is the share of uploads rejected with HTTP 500 (drawn from a seeded random generator).
+    With delete_rate, deletes are answered at once and carried out in the background at that many photos
+    per second, like a server-side job.
+    """
+
+    def __init__(self, session_id='fake-session', port=0, username='user@example.com', password='password',
+                 playlists=('Fake playlist',), bandwidth_mbps=None, latency=0.0, failure_rate=0.0, progress_linger=1.0, seed=0,
+                 thumbnail_kb=30, delete_rate=None):
+        self.session_id = session_id
+        self.username = username
+        self.password = password
+        self.playlists = {str(1000 + index): {'name': name, 'photos': []} for index, name in enumerate(playlists)}
+        self.bandwidth = bandwidth_mbps * 1024 * 1024 / 8 if bandwidth_mbps else None
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.progress_linger = progress_linger
+        self.delete_rate = delete_rate
+        self.random = random.Random(seed)
+        # Stand-ins for photo thumbnails and the web font, so the pages weigh something
+        self.thumbnail = b'\xff\xd8\xff\xe0' + bytes(thumbnail_kb * 1024)
+        self.font = bytes(60 * 1024)
+        self.uploads = []
+        self.requests = 0
+        self.lock = threading.Lock()
+        # Time until which the simulated uplink is busy, shared by all connections
+        self.link_free_at = 0.0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug("Fake Nixplay: " + format % args)
+
+            def do_GET(self):
+                server.handle(self, 'GET')
+
+            def do_POST(self):
+                server.handle(self, 'POST')
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+
+    def start(self):
+        """Serve in a background thread; returns the base URL."""
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def add_photos(self, playlist_name, names):
+        """Put photos in a playlist directly, e.g. to start a benchmark from a full playlist."""
+        with self.lock:
+            playlist = next(p for p in self.playlists.values() if p['name'] == playlist_name)
+            playlist['photos'].extend(names)
+
+    def photo_names(self, playlist_name):
+        with self.lock:
+            return list(next(p for p in self.playlists.values() if p['name'] == playlist_name)['photos'])
+
+    def remove_photos(self, playlist, names):
+        """Remove photos from a playlist, at delete_rate photos/s on a background thread if set."""
+        def remove(chunk):
+            with self.lock:
+                for name in chunk:
+                    # Photos uploaded again under the same name come later in the list and are not hit
+                    if name in playlist['photos']:
+                        playlist['photos'].remove(name)
+
+        if not self.delete_rate:
+            return remove(names)
+
+        def remove_gradually():
+            step = max(1, int(self.delete_rate / 10))
+            for start in range(0, len(names), step):
+                time.sleep(step / self.delete_rate)
+                remove(names[start:start + step])
+        threading.Thread(target=remove_gradually, daemon=True).start()
+
+    def send(self, request, status, body, content_type='application/json', headers=()):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode() if content_type == 'application/json' else body.encode()
+        request.send_response(status)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(body)
+
+    def respond(self, request, status, payload):
+        self.send(request, status, payload)
+
+    def redirect(self, request, location, headers=()):
+        self.send(request, 303, b'', 'text/plain', [('Location', location), *headers])
+
+    def logged_in(self, request):
+        cookie = SimpleCookie(request.headers.get('Cookie', ''))
+        return 'sessionid' in cookie and cookie['sessionid'].value == self.session_id
+
+    def read_body(self, request):
+        """Read the request body at the simulated bandwidth."""
+        remaining = int(request.headers.get('Content-Length', 0))
+        chunks = []
+        while remaining > 0:
+            chunk = request.rfile.read(min(remaining, 64 * 1024))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            chunks.append(chunk)
+            if self.bandwidth:
+                with self.lock:
+                    self.link_free_at = max(self.link_free_at, time.time()) + len(chunk) / self.bandwidth
+                    delay = self.link_free_at - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+        return b''.join(chunks)
+
+    def handle(self, request, method):
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        path = request.path.split('?')[0]
+        body = self.read_body(request) if method == 'POST' else b''
+
+        if path == '/login':
+            if method == 'POST':
+                form = urllib.parse.parse_qs(body.decode())
+                if form.get('username') == [self.username] and form.get('password') == [self.password]:
+                    return self.redirect(request, '/#/playlists', [('Set-Cookie', f"sessionid={self.session_id}; Path=/; HttpOnly")])
+                return self.send(request, 200, FAKE_LOGIN_HTML % {'message': '<p class="error">Invalid email or password</p>'}, 'text/html')
+            return self.send(request, 200, FAKE_LOGIN_HTML % {'message': ''}, 'text/html')
+
+        if not self.logged_in(request):
+            if path == '/':
+                return self.redirect(request, '/login')
+            return self.respond(request, 403, {'error': 'not logged in'})
+        if path == '/':
+            return self.send(request, 200, FAKE_APP_HTML % {'linger_ms': int(self.progress_linger * 1000)}, 'text/html')
+        if path.startswith('/thumbnails/'):
+            return self.send(request, 200, self.thumbnail, 'image/jpeg', [('Cache-Control', 'no-store')])
+        if path == '/static/nix-sans.woff2':
+            return self.send(request, 200, self.font, 'font/woff2')
+        if path == '/api/playlists' and method == 'GET':
+            with self.lock:
+                playlists = [{'id': playlist_id, 'name': p['name'], 'count': len(p['photos'])} for playlist_id, p in self.playlists.items()]
+            return self.respond(request, 200, playlists)
+
+        match = re.fullmatch(r'/api/playlists/(\d+)(/photos/?|/delete)?', path)
+        if not match or match.group(1) not in self.playlists:
+            return self.respond(request, 404, {'error': 'not found'})
+        playlist_id, action = match.groups()
+        playlist = self.playlists[playlist_id]
+        if method == 'GET' and not action:
+            with self.lock:
+                return self.respond(request, 200, {'id': playlist_id, 'name': playlist['name'], 'photos': list(playlist['photos'])})
+        if method == 'POST' and action == '/delete':
+            names = json.loads(body or b'{}')
+            with self.lock:
+                if names.get('all'):
+                    doomed = list(playlist['photos'])
+                else:
+                    wanted = set(names.get('names', []))
+                    doomed = [name for name in playlist['photos'] if name in wanted]
+            self.remove_photos(playlist, doomed)
+            return self.respond(request, 200, {'deleting': len(doomed)})
+        if method == 'POST' and action:
+            return self.handle_upload(request, playlist_id, body)
+        return self.respond(request, 405, {'error': 'method not allowed'})
+
+    def handle_upload(self, request, playlist_id, body):
+        header = f"Content-Type: {request.headers.get('Content-Type', '')}\r\n\r\n".encode()
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(header + body)
+        stored = [(playlist_id, part.get_filename(), len(part.get_payload(decode=True)))
+                  for part in (message.iter_parts() if message.is_multipart() else []) if part.get_filename()]
+        if not stored:
+            return self.respond(request, 400, {'error': 'no file'})
+        with self.lock:
+            if self.failure_rate and self.random.random() < self.failure_rate:
+                failed = True
+            else:
+                failed = False
+                self.uploads.extend(stored)
+                self.playlists[playlist_id]['photos'].extend(name for _, name, _ in stored)
+        if failed:
+            return self.respond(request, 500, {'error': 'simulated failure'})
+        self.respond(request, 201, {'uploaded': [name for _, name, _ in stored]})
@@ -2,17 +2,27 @@ import os
 import random
 import time
 import json
-from datetime import datetime
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+import sys
+from datetime import datetime, timedelta
 import traceback
 import re
 import logging
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
-from webdriver_manager.chrome import ChromeDriverManager
+import sqlite3
+import argparse
+import hashlib
+import struct
+import heapq
+import functools
+import mmap
+import importlib.util
+import queue
+import subprocess
+from collections import deque
+import mimetypes
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+# selenium and webdriver_manager are imported where a browser is needed, so scan and plan start fast without them
 
 # Initialize logger
 logger = logging.getLogger(__name__)
@@ -22,22 +32,232 @@ handler = logging.StreamHandler()
 handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
 logger.addHandler(handler)
 
-def save_debug_snapshot(driver, label):
-    """Save screenshot and page source for debugging."""
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    safe_label = label.replace(" ", "_").lower()
-    os.makedirs("debug", exist_ok=True)
-    
-    screenshot_path = os.path.join("debug", f"{timestamp}_{safe_label}.png")
-    html_path = os.path.join("debug", f"{timestamp}_{safe_label}.html")
-    
-    try:
-        driver.save_screenshot(screenshot_path)
-        with open(html_path, 'w', encoding='utf-8') as f:
-            f.write(driver.page_source)
-        logger.debug(f"Saved debug snapshot: {screenshot_path}, {html_path}")
-    except Exception as e:
-        logger.error(f"Failed to save debug snapshot for '{label}': {e}")
+# Name of the sync job the current thread works for, when several jobs run in parallel
+job_context = threading.local()
+
+
+class JobLogFilter(logging.Filter):
+    """Tag log records with the job of the current thread; with a job_name, only let that job's records through."""
+
+    def __init__(self, job_name=None):
+        super().__init__()
+        self.job_name = job_name
+
+    def filter(self, record):
+        record.job = getattr(job_context, 'name', None) or '-'
+        return self.job_name is None or record.job == self.job_name
+
+
+handler.addFilter(JobLogFilter())
+
+class SnapshotRecorder:
+    """Debug snapshots of the browser, written to disk by a background thread.
+
+    level "all" saves a screenshot and the page source at every snapshot. level "errors" only keeps the
+    last ring_size snapshots as lightweight breadcrumbs (label, time, URL, title) in memory; when an error
+    snapshot is taken, it saves a full capture of the page plus the breadcrumbs leading up to it.
+    level "off" records nothing.
+    """
+
+    def __init__(self, level='errors', ring_size=10, directory='debug'):
+        self.level = level
+        self.directory = directory
+        self.ring = deque(maxlen=ring_size)
+        self.writes = queue.Queue()
+        self.writer = None
+
+    def snapshot(self, driver, label, error=False):
+        if self.level == 'off':
+            return
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        safe_label = label.replace(" ", "_").lower()
+        if getattr(job_context, 'name', None):
+            safe_label = f"{job_context.name}_{safe_label}"
+        try:
+            if self.level == 'all' or error:
+                # Reading the page has to happen on this thread; only the disk writes are deferred
+                base_path = os.path.join(self.directory, f"{timestamp}_{safe_label}")
+                self.write(base_path + ".png", driver.get_screenshot_as_png())
+                self.write(base_path + ".html", driver.page_source.encode('utf-8'))
+                if error and self.ring:
+                    self.write(base_path + "_trail.json", json.dumps(list(self.ring), indent=1).encode('utf-8'))
+                logger.debug(f"Saved debug snapshot: {base_path}.png, {base_path}.html")
+            url, title = driver.execute_script("return [location.href, document.title];")
+            self.ring.append({'time': timestamp, 'label': label, 'url': url, 'title': title})
+        except Exception as e:
+            logger.error(f"Failed to save debug snapshot for '{label}': {e}")
+
+    def write(self, path, data):
+        if self.writer is None:
+            self.writer = threading.Thread(target=self.write_loop, daemon=True)
+            self.writer.start()
+        self.writes.put((path, data))
+
+    def write_loop(self):
+        while True:
+            path, data = self.writes.get()
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(data)
+            except Exception as e:
+                logger.error(f"Failed to write debug snapshot '{path}': {e}")
+            finally:
+                self.writes.task_done()
+
+    def flush(self):
+        """Wait until every queued snapshot is on disk."""
+        self.writes.join()
+
+
+snapshots = SnapshotRecorder()
+
+
+def save_debug_snapshot(driver, label, error=False):
+    """Record a debug snapshot of the browser; error=True marks a failure, which is always saved to disk."""
+    snapshots.snapshot(driver, label, error)
+
+
+class RunMetrics:
+    """Timing spans and event counts of a run, written as a JSON report and optionally a Prometheus textfile.
+
+    Spans are recorded by functions wrapped with timed(). While disabled (the default) nothing is recorded
+    and the wrappers call straight through, so instrumentation costs one attribute check per call.
+    """
+
+    def __init__(self, json_path=None, prometheus_path=None):
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.lock = threading.Lock()
+        self.start()
+
+    @property
+    def enabled(self):
+        return bool(self.json_path or self.prometheus_path)
+
+    def start(self):
+        """Forget what was recorded and start timing a new run."""
+        with self.lock:
+            self.start_time = time.time()
+            self.spans = []
+            self.events = {}
+
+    def record(self, phase, start_time, seconds, ok, attributes):
+        span = {'phase': phase, 'job': getattr(job_context, 'name', None), 'start': round(start_time - self.start_time, 3),
+                'seconds': round(seconds, 3), 'ok': ok, **attributes}
+        with self.lock:
+            self.spans.append(span)
+
+    def event(self, name, count=1):
+        """Count count events (e.g. a stalled upload, or photos queued for retry) while metrics are enabled."""
+        if not self.enabled:
+            return
+        key = (getattr(job_context, 'name', None), name)
+        with self.lock:
+            self.events[key] = self.events.get(key, 0) + count
+
+    def phases(self):
+        """Totals per (job, phase): calls, failures, seconds, max_seconds, files and bytes."""
+        phases = {}
+        for span in self.spans:
+            phase = phases.setdefault((span['job'], span['phase']),
+                                      {'calls': 0, 'failures': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'files': 0, 'bytes': 0})
+            phase['calls'] += 1
+            phase['failures'] += not span['ok']
+            phase['seconds'] += span['seconds']
+            phase['max_seconds'] = max(phase['max_seconds'], span['seconds'])
+            phase['files'] += span.get('files', 0)
+            phase['bytes'] += span.get('bytes', 0)
+        return phases
+
+    def write(self, ok):
+        """Write the report of the run so far to the configured files; ok is the outcome of the run."""
+        if not self.enabled:
+            return
+        with self.lock:
+            phases = self.phases()
+            events = dict(self.events)
+            spans = list(self.spans)
+        run_seconds = time.time() - self.start_time
+        try:
+            if self.json_path:
+                report = {
+                    'started': datetime.fromtimestamp(self.start_time).isoformat(timespec='seconds'),
+                    'seconds': round(run_seconds, 3),
+                    'ok': ok,
+                    'phases': [{'job': job, 'phase': phase, **totals} for (job, phase), totals in phases.items()],
+                    'events': [{'job': job, 'event': event, 'count': count} for (job, event), count in events.items()],
+                    'spans': spans,
+                }
+                self.write_file(self.json_path, json.dumps(report, indent=1))
+            if self.prometheus_path:
+                self.write_file(self.prometheus_path, self.prometheus_text(phases, events, run_seconds, ok))
+        except OSError as e:
+            logger.warning(f"Could not write run metrics: {e}")
+
+    def prometheus_text(self, phases, events, run_seconds, ok):
+        def labels(job, **values):
+            if job:
+                values = {'job': job, **values}
+            escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values.values())
+            return '{' + ','.join(f'{name}="{value}"' for name, value in zip(values, escaped)) + '}'
+
+        lines = []
+        for name, key, help_text in (
+                ('nixupload_phase_seconds', 'seconds', 'Seconds spent in each phase during the last run.'),
+                ('nixupload_phase_max_seconds', 'max_seconds', 'Longest single call of each phase during the last run.'),
+                ('nixupload_phase_calls', 'calls', 'Calls of each phase during the last run.'),
+                ('nixupload_phase_failures', 'failures', 'Failed calls of each phase during the last run.'),
+                ('nixupload_phase_files', 'files', 'Files handled by each phase during the last run.'),
+                ('nixupload_phase_bytes', 'bytes', 'Bytes handled by each phase during the last run.')):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            lines += [f"{name}{labels(job, phase=phase)} {totals[key]:g}" for (job, phase), totals in phases.items()]
+        lines += ["# HELP nixupload_events Events (stalled or timed out uploads, retries) during the last run.", "# TYPE nixupload_events gauge"]
+        lines += [f"nixupload_events{labels(job, event=event)} {count}" for (job, event), count in events.items()]
+        lines += ["# HELP nixupload_run_seconds Duration of the last run.", "# TYPE nixupload_run_seconds gauge",
+                  f"nixupload_run_seconds {run_seconds:.3f}",
+                  "# HELP nixupload_run_success Whether the last run succeeded.", "# TYPE nixupload_run_success gauge",
+                  f"nixupload_run_success {int(bool(ok))}",
+                  "# HELP nixupload_run_timestamp_seconds When the last run ended.", "# TYPE nixupload_run_timestamp_seconds gauge",
+                  f"nixupload_run_timestamp_seconds {time.time():.0f}"]
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path, text):
+        # Readers such as the node exporter must never see a half-written file
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+
+metrics = RunMetrics()
+
+
+def timed(phase, describe=None):
+    """Decorator recording a metrics span for every call while metrics are enabled.
+
+    The span fails if the call raises or returns False. describe(result, *args, **kwargs), if given,
+    returns extra span attributes (files, bytes, state, or ok to override the outcome).
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return function(*args, **kwargs)
+            start_time = time.time()
+            ok = False
+            attributes = {}
+            try:
+                result = function(*args, **kwargs)
+                ok = result is not False
+                if describe:
+                    attributes = describe(result, *args, **kwargs)
+                    ok = attributes.pop('ok', ok)
+                return result
+            finally:
+                metrics.record(phase, start_time, time.time() - start_time, ok, attributes)
+        return wrapper
+    return decorate
 
 
 def load_config(config_file='config.json'):
@@ -47,9 +267,15 @@ def load_config(config_file='config.json'):
             config = json.load(f)
         
         required_keys = ['username', 'password', 'playlist_name', 'photos_directory', 'max_photos', 'base_url']
-        for key in required_keys:
-            if key not in config:
-                raise KeyError(f"Missing required key '{key}' in config file")
+        # With a "jobs" list, required keys may be given per job or once for all of them
+        jobs = config.get('jobs', [{}])
+        for job in jobs:
+            for key in required_keys:
+                if key not in job and key not in config:
+                    raise KeyError(f"Missing required key '{key}' in config file")
+        names = [job_name(config, job) for job in jobs]
+        if len(set(names)) != len(names):
+            raise ValueError("Every job needs a different name (or playlist_name)")
         
         return config
     except FileNotFoundError:
@@ -63,39 +289,849 @@ def load_config(config_file='config.json'):
         exit(1)
 
 
+def job_name(config, job):
+    """Name of a job in a config's "jobs" list: its "name", or else its playlist_name, made safe for file names."""
+    name = job.get('name') or job.get('playlist_name') or config.get('playlist_name')
+    return re.sub(r'[^\w.-]+', '_', name)
+
+
+def job_configs(config):
+    """Expand the "jobs" list of a config into one flat config per job; settings outside "jobs" are shared by all.
+
+    Unless a job sets them itself, its journal, manifest and Chrome profile are named after the job, so jobs
+    running at the same time do not share state. Browsers of parallel jobs default to a 512MB memory cap.
+    """
+    if 'jobs' not in config:
+        return [config]
+    defaults = {key: value for key, value in config.items() if key != 'jobs'}
+    defaults.setdefault('browser_memory_mb', 512)
+    configs = []
+    for job in config['jobs']:
+        name = job_name(config, job)
+        job_config = {**defaults, **job, 'name': name}
+        for key, default in (('journal_file', 'journal.jsonl'), ('manifest_file', 'manifest.json')):
+            if key not in job:
+                base, ext = os.path.splitext(defaults.get(key, default))
+                job_config[key] = f"{base}-{name}{ext}"
+        if 'chrome_profile_dir' not in job and defaults.get('chrome_profile_dir'):
+            job_config['chrome_profile_dir'] = os.path.join(defaults['chrome_profile_dir'], name)
+        configs.append(job_config)
+    return configs
+
+
 import os
 
 import os
 
-def get_image_files(directory, max_file_size_mb, max_photos):
-    """Recursively get all image files from a directory, skipping folders with a .nonixplay file."""
-    valid_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp']
-    image_files = []
+VALID_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp')
+NO_NIXPLAY_MARKER = '.nonixplay'
+
+# Hooks into the playlist page for reading, selecting and deleting single photos: the photos (titled with
+# their file name), the checkbox that selects one, the ng-click action of "Delete selected photos", the
+# element that holds the loaded photo list and, optionally, an element whose text holds the photo count.
+# They match the benchmark's stand-in server but have not been checked against nixplay.com, so each one
+# can be overridden in config.json; main() updates this dict.
+page_hooks = {
+    'photo_item_css': "div.photo-item[title]",
+    'photo_select_css': ".photo-select",
+    'delete_selected_action': "deleteSelectedSlides",
+    'photo_list_css': "#photos",
+    'photo_count_css': None,
+}
+
+# Extra Chrome flags of the lean browser: no background services or features the script never uses
+LEAN_CHROME_FLAGS = [
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--mute-audio",
+    "--no-first-run",
+    "--disable-features=Translate,MediaRouter,OptimizationHints",
+]
+
+# What the lean browser does not download (images are blocked through a content setting instead)
+LEAN_BLOCKED_URLS = [
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*fonts.googleapis.com*", "*fonts.gstatic.com*",
+    "*.mp4", "*.webm", "*.mov", "*.m4v", "*.mp3",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*", "*facebook.net*",
+    "*hotjar.com*", "*segment.io*", "*mixpanel.com*", "*intercom.io*", "*sentry.io*",
+]
+
+# In-page helper installed as window.__nixUpload, so compound lookups and actions on the Nixplay pages cost
+# one WebDriver round trip instead of one per find, wait, attribute read and click. Called through page_call().
+PAGE_HELPER_JS = """
+window.__nixUpload = (function () {
+    var uploadStage = 0, menuOpenedAt = 0;
+
+    function all(selector) { return Array.prototype.slice.call(document.querySelectorAll(selector)); }
+    function visible(el) { return !!el && !!(el.offsetWidth || el.offsetHeight || el.getClientRects().length); }
+    function text(el) { return el.textContent.replace(/\\s+/g, ' ').trim(); }
+    function first(expr) {
+        return document.evaluate(expr, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    }
+
+    return {
+        // Everything needed to tell which page is showing: URL, login form, playlist names, photo names and,
+        // when the page shows one, the photo count
+        state: function (photoCss, listCss, countCss) {
+            var photos = all(photoCss).map(function (el) { return el.getAttribute('title'); });
+            var countText = countCss && document.querySelector(countCss);
+            var countMatch = countText && text(countText).match(/\\d[\\d,.]*/);
+            return {
+                url: location.href,
+                loginForm: !!document.getElementById('login_username'),
+                playlistShown: !!document.getElementById('add-photos'),
+                photoListShown: !listCss || !!document.querySelector(listCss),
+                playlists: all('span.name[title]').map(function (el) { return el.getAttribute('title'); }),
+                photoNames: photos,
+                photoCount: photos.length,
+                reportedCount: countMatch ? parseInt(countMatch[0].replace(/[,.]/g, ''), 10) : null
+            };
+        },
+
+        // Click the playlist with this name; returns its index once clicked, null while it is not there yet
+        openPlaylist: function (name) {
+            var span = all('span.name[title]').filter(function (el) {
+                return el.className === 'name' && el.getAttribute('title') === name;
+            })[0];
+            var container = span && span.closest("div[id*='playlist-']");
+            if (!container) return null;
+            var index = parseInt(container.id.match(/\\d+/)[0], 10);
+            var wrapper = all('div[id="playlist-' + index + '"] div').filter(function (el) {
+                return el.className === 'playlist-draggable-wrapper';
+            })[0];
+            if (!visible(wrapper)) return null;
+            wrapper.click();
+            return {index: index};
+        },
+
+        // Open the file picker of "Add photos" > "From my computer": returns {input: <file input>} when done,
+        // else {waiting: step}. Resumes where the last call stopped unless restart is set.
+        startUpload: function (restart) {
+            if (restart) uploadStage = 0;
+            if (uploadStage === 0) {
+                if (visible(document.querySelector('.nix-upload-modal-bg'))) return {waiting: 'upload dialog to close'};
+                var add = document.getElementById('add-photos');
+                if (!visible(add)) return {waiting: "'Add photos'"};
+                add.scrollIntoView(true);
+                add.click();
+                uploadStage = 1;
+            }
+            if (uploadStage === 1) {
+                var fromComputer = first("//span[text()='From my computer']");
+                if (!fromComputer) return {waiting: "'From my computer'"};
+                fromComputer.click();
+                uploadStage = 2;
+            }
+            var input = document.getElementById('upload');
+            if (!input) return {waiting: 'file input'};
+            uploadStage = 0;
+            return {input: input};
+        },
+
+        // Tick the select box of every photo with one of these names, unless some of them are missing
+        selectPhotos: function (photoCss, selectCss, names) {
+            var items = all(photoCss), wanted = {}, found = {};
+            names.forEach(function (name) { wanted[name] = true; });
+            items.forEach(function (item) {
+                if (wanted.hasOwnProperty(item.getAttribute('title'))) found[item.getAttribute('title')] = true;
+            });
+            var missing = names.filter(function (name) { return !found[name]; });
+            if (missing.length) return {missing: missing, selected: 0};
+            var selected = 0;
+            items.forEach(function (item) {
+                var box = item.querySelector(selectCss);
+                if (box && wanted.hasOwnProperty(item.getAttribute('title'))) { box.click(); selected++; }
+            });
+            return {missing: [], selected: selected};
+        },
+
+        // Open the Actions menu and click the entry whose ng-click contains all of parts; false until it worked
+        clickMenuItem: function (parts) {
+            function find() {
+                return all('a[ng-click]').filter(function (a) {
+                    var action = a.getAttribute('ng-click');
+                    return visible(a) && parts.every(function (part) { return action.indexOf(part) >= 0; });
+                })[0];
+            }
+            var link = find();
+            if (!link) {
+                // Give a menu that was just opened time to show before toggling it again
+                if (Date.now() - menuOpenedAt < 2000) return false;
+                var button = all('button.dropdown-toggle.btn-gray').filter(function (b) { return visible(b) && !b.disabled; })[0];
+                if (!button) return false;
+                button.click();
+                menuOpenedAt = Date.now();
+                link = find();
+                if (!link) return false;
+            }
+            link.click();
+            menuOpenedAt = 0;
+            return true;
+        },
+
+        // Title of the visible modal, or null
+        modalTitle: function () {
+            var title = all('.nix-modal-title-text').filter(visible)[0];
+            return title ? text(title) : null;
+        },
+
+        // Click the visible, enabled button with this text; false if there is none
+        clickButton: function (label) {
+            var button = all('button').filter(function (b) { return visible(b) && !b.disabled && text(b) === label; })[0];
+            if (!button) return false;
+            button.click();
+            return true;
+        }
+    };
+})();
+"""
+
+PAGE_CALL_JS = "var helper = window.__nixUpload; return helper ? helper[arguments[0]].apply(null, arguments[1]) : '__nixUpload missing';"
+
 
+def open_catalog(catalog_path):
+    """Open the on-disk photo catalog, creating its tables if needed."""
+    conn = sqlite3.connect(catalog_path)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS dirs (
+            path TEXT PRIMARY KEY,
+            parent TEXT,
+            mtime_ns INTEGER NOT NULL,
+            skipped INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS dirs_parent ON dirs(parent);
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            dir TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS files_dir ON files(dir);
+        CREATE INDEX IF NOT EXISTS files_size ON files(size);
+        CREATE TABLE IF NOT EXISTS hashes (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            digest TEXT NOT NULL,
+            phash TEXT
+        );
+        CREATE TABLE IF NOT EXISTS metadata (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            taken TEXT,
+            width INTEGER,
+            height INTEGER,
+            orientation INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS metadata_taken ON metadata(taken);
+    """)
+    return conn
+
+
+def list_directory(path):
+    """List one directory: returns (skipped, [(file_path, size, mtime_ns)], [subdir_paths]).
+
+    A directory holding a .nonixplay file is reported as skipped with no files or subdirectories.
+    """
+    files = []
+    subdirs = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                    continue
+                if entry.name == NO_NIXPLAY_MARKER:
+                    return True, [], []
+                if entry.name.lower().endswith(VALID_EXTENSIONS):
+                    st = entry.stat()
+                    files.append((entry.path, st.st_size, st.st_mtime_ns))
+            except OSError as e:
+                logger.warning(f"Skipping '{entry.path}': {e}")
+    return False, files, subdirs
+
+
+def walk_parallel(roots, visit, workers):
+    """Walk a tree on a thread pool, yielding results as they complete.
+
+    visit(item) returns (result, children); children are submitted to the pool as soon as they are known,
+    so sibling directories are listed concurrently (which hides latency on network mounts).
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(visit, item) for item in roots}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result, children = future.result()
+                pending.update(pool.submit(visit, child) for child in children)
+                yield result
+
+
+def iter_image_files(directory, workers=8):
+    """Yield (path, size) for every image under directory, skipping folders with a .nonixplay file.
+
+    Subfolders that cannot be read or vanish while scanning are skipped, like os.walk does.
+    """
+    def visit(path):
+        try:
+            skipped, files, subdirs = list_directory(path)
+        except OSError as e:
+            if path == directory:
+                raise
+            if not isinstance(e, FileNotFoundError):
+                logger.warning(f"Skipping directory '{path}': {e}")
+            return [], []
+        if skipped:
+            logger.debug(f"Skipping directory: {path} (contains {NO_NIXPLAY_MARKER})")
+        return files, subdirs
+
+    for files in walk_parallel([directory], visit, workers):
+        for file_path, size, _ in files:
+            yield file_path, size
+
+
+def catalog_range(directory):
+    """(low, high) such that low <= path < high holds exactly for the paths below directory."""
+    prefix = directory if directory.endswith(os.sep) else directory + os.sep
+    return prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+
+def update_catalog(conn, directory, rebuild=False, workers=8):
+    """Bring the catalog in line with the directory tree, re-listing only directories whose mtime changed.
+
+    A directory's mtime changes when entries are added, removed or renamed in it, so unchanged
+    directories reuse their cached files and subdirectories and only cost one stat. Files that are
+    rewritten in place keep their cached size until the directory changes or rebuild=True.
+    Only entries below directory are touched, so one catalog can hold several photo directories.
+    """
+    low, high = catalog_range(directory)
+    if rebuild:
+        logger.info("Rebuilding photo catalog from scratch...")
+        conn.execute("DELETE FROM files WHERE path >= ? AND path < ?", (low, high))
+        conn.execute("DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)", (directory, low, high))
+
+    cached = {}
+    children = {}
+    for path, parent, mtime_ns, skipped in conn.execute("SELECT path, parent, mtime_ns, skipped FROM dirs WHERE path = ? OR (path >= ? AND path < ?)",
+                                                         (directory, low, high)):
+        cached[path] = (mtime_ns, skipped)
+        children.setdefault(parent, []).append(path)
+
+    def visit(item):
+        # Runs on the pool: stat (and list if changed) one directory; the database is only touched by the caller.
+        # A subdirectory that cannot be read counts as empty, recorded with an mtime that never matches so it is listed
+        # again next run; one that vanished is dropped.
+        path, parent = item
+        try:
+            dir_mtime_ns = os.stat(path).st_mtime_ns
+            entry = cached.get(path)
+            if entry is not None and entry[0] == dir_mtime_ns:
+                subdirs = [] if entry[1] else children.get(path, [])
+                return (path, parent, dir_mtime_ns, None), [(child, path) for child in subdirs]
+            listing = list_directory(path)
+        except OSError as e:
+            if parent is None:
+                raise
+            if isinstance(e, FileNotFoundError):
+                return None, []
+            logger.warning(f"Skipping directory '{path}': {e}")
+            return (path, parent, -1, (False, [], [])), []
+        return (path, parent, dir_mtime_ns, listing), [(subdir, path) for subdir in listing[2]]
+
+    seen = set()
+    relisted = 0
+    for result in walk_parallel([(directory, None)], visit, workers):
+        if result is None:
+            continue
+        path, parent, dir_mtime_ns, listing = result
+        seen.add(path)
+        if listing is None:
+            continue
+
+        skipped, files, _ = listing
+        if skipped:
+            logger.debug(f"Skipping directory: {path} (contains {NO_NIXPLAY_MARKER})")
+        conn.execute("INSERT OR REPLACE INTO dirs (path, parent, mtime_ns, skipped) VALUES (?, ?, ?, ?)",
+                     (path, parent, dir_mtime_ns, int(skipped)))
+        conn.execute("DELETE FROM files WHERE dir = ?", (path,))
+        conn.executemany("INSERT OR REPLACE INTO files (path, dir, size, mtime_ns) VALUES (?, ?, ?, ?)",
+                         [(file_path, path, size, mtime_ns) for file_path, size, mtime_ns in files])
+        relisted += 1
+
+    stale = [(path,) for path in cached if path not in seen]
+    conn.executemany("DELETE FROM files WHERE dir = ?", stale)
+    conn.executemany("DELETE FROM dirs WHERE path = ?", stale)
+    conn.commit()
+    logger.info(f"Photo catalog updated: {relisted} of {len(seen)} directories re-listed, {len(stale)} removed.")
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """Content digest of a file, read through mmap (or in chunks where the file cannot be mapped)."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Empty files and some network file systems cannot be mapped
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        else:
+            with mapped:
+                digest.update(mapped)
+    return digest.hexdigest()
+
+
+def perceptual_hash(path):
+    """64-bit difference hash (dHash) of an image, equal for resized or re-encoded copies; needs Pillow."""
+    from PIL import Image
+    with Image.open(path) as img:
+        # Let JPEG decode at reduced scale, the hash only needs 9x8 pixels
+        img.draft('L', (64, 64))
+        pixels = list(img.convert('L').resize((9, 8)).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+
+def near_duplicate_groups(phashes, max_distance=4):
+    """Map each perceptual hash to a representative of its group of hashes at most max_distance bits apart.
+
+    Two hashes within max_distance bits agree exactly on at least one of max_distance + 1 bands of bits,
+    so only hashes sharing a band are compared instead of all pairs.
+    """
+    values = {phash: int(phash, 16) for phash in phashes}
+    parent = {phash: phash for phash in values}
+
+    def find(phash):
+        while parent[phash] != phash:
+            parent[phash] = parent[parent[phash]]
+            phash = parent[phash]
+        return phash
+
+    bands = max_distance + 1
+    for band in range(bands):
+        low, high = 64 * band // bands, 64 * (band + 1) // bands
+        mask = ((1 << (high - low)) - 1) << low
+        buckets = {}
+        for phash, value in values.items():
+            buckets.setdefault(value & mask, []).append(phash)
+        for bucket in buckets.values():
+            for i, a in enumerate(bucket):
+                for b in bucket[i + 1:]:
+                    if bin(values[a] ^ values[b]).count('1') <= max_distance:
+                        root_a, root_b = find(a), find(b)
+                        if root_a != root_b:
+                            parent[max(root_a, root_b)] = min(root_a, root_b)
+    return {phash: find(phash) for phash in values}
+
+
+def hash_photo(path, perceptual=False):
+    """Hash one photo on the pool: returns (digest, phash); digest is None if the file could not be read,
+    phash is "" if the image could not be decoded."""
     try:
-        for root, dirs, files in os.walk(directory):
-            # Skip this directory if it contains a .nonixplay file
-            if '.nonixplay' in files:
-                logger.debug(f"Skipping directory: {root} (contains .nonixplay)")
-                dirs[:] = []  # Prevent descending into subdirectories
-                continue
+        digest = hash_file(path)
+    except OSError as e:
+        logger.warning(f"Could not hash '{path}': {e}")
+        return None, None
+    phash = None
+    if perceptual:
+        try:
+            phash = perceptual_hash(path)
+        except Exception as e:
+            logger.debug(f"No perceptual hash for '{path}': {e}")
+            phash = ""
+    return digest, phash
+
+
+def update_hashes(conn, directory, workers=4, perceptual=False):
+    """Bring the content hashes of the catalogued files below directory up to date.
+
+    Hashes are cached by path, size and mtime, so only new or changed files are read. Hashing runs on a
+    thread pool: hashlib and Pillow release the GIL while they work.
+    """
+    low, high = catalog_range(directory)
+    conn.execute("DELETE FROM hashes WHERE path >= ? AND path < ? AND path NOT IN (SELECT path FROM files)", (low, high))
+    todo = conn.execute("""
+        SELECT f.path, f.size, f.mtime_ns FROM files f LEFT JOIN hashes h ON h.path = f.path
+        WHERE f.path >= ? AND f.path < ?
+          AND (h.path IS NULL OR h.size != f.size OR h.mtime_ns != f.mtime_ns OR (? AND h.phash IS NULL))
+    """, (low, high, perceptual)).fetchall()
+    if todo:
+        logger.info(f"Hashing {len(todo)} new or changed photos...")
+        hashed = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(hash_photo, [path for path, _, _ in todo], [perceptual] * len(todo))
+            for (path, size, mtime_ns), (digest, phash) in zip(todo, results):
+                if digest is None:
+                    continue
+                conn.execute("INSERT OR REPLACE INTO hashes (path, size, mtime_ns, digest, phash) VALUES (?, ?, ?, ?, ?)",
+                             (path, size, mtime_ns, digest, phash))
+                hashed += 1
+                # Commit as we go, so an interrupted first run does not have to start over
+                if hashed % 1000 == 0:
+                    conn.commit()
+        logger.info(f"Hashed {hashed} photos.")
+    conn.commit()
+
+
+def parse_exif(tiff):
+    """Capture date ('YYYY-MM-DD HH:MM:SS' or None) and orientation (1-8 or None) from an EXIF TIFF block."""
+    order = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if order is None:
+        return None, None
+
+    def entries(offset):
+        count, = struct.unpack_from(order + 'H', tiff, offset)
+        for index in range(count):
+            yield struct.unpack_from(order + 'HHI4s', tiff, offset + 2 + 12 * index)
+
+    def text(count, value):
+        data = value if count <= 4 else tiff[struct.unpack(order + 'I', value)[0]:][:count]
+        return data.split(b'\0')[0].decode('ascii', 'replace')
+
+    dates = {}
+    orientation = None
+    try:
+        ifd0, = struct.unpack_from(order + 'I', tiff, 4)
+        exif_ifd = None
+        for tag, kind, count, value in entries(ifd0):
+            if tag == 0x0112 and kind == 3:
+                orientation, = struct.unpack(order + 'H', value[:2])
+            elif tag == 0x0132:
+                dates[tag] = text(count, value)
+            elif tag == 0x8769:
+                exif_ifd, = struct.unpack(order + 'I', value)
+        if exif_ifd:
+            for tag, kind, count, value in entries(exif_ifd):
+                if tag in (0x9003, 0x9004):
+                    dates[tag] = text(count, value)
+    except (struct.error, IndexError):
+        pass
+
+    # DateTimeOriginal, else DateTimeDigitized, else DateTime; cameras without a clock write zeros
+    for tag in (0x9003, 0x9004, 0x0132):
+        try:
+            return datetime.strptime(dates.get(tag, '').strip(), '%Y:%m:%d %H:%M:%S').strftime('%Y-%m-%d %H:%M:%S'), orientation
+        except ValueError:
+            pass
+    return None, orientation
+
+
+def read_image_metadata(path):
+    """Read capture date, size and orientation from the image header only: returns (taken, width, height, orientation).
+
+    JPEG segments are skipped by their lengths up to the frame header, so the image data is never read.
+    width and height are as displayed (swapped for EXIF orientations 5-8). Unknown values are None.
+    """
+    taken = width = height = orientation = None
+    with open(path, 'rb') as f:
+        head = f.read(32)
+        if head[:2] == b'\xff\xd8':
+            f.seek(2)
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    break
+                kind = marker[1]
+                while kind == 0xFF:
+                    fill = f.read(1)
+                    kind = fill[0] if fill else 0xD9
+                if kind == 0x01 or 0xD0 <= kind <= 0xD8:
+                    continue
+                if kind in (0xD9, 0xDA):
+                    break
+                length_bytes = f.read(2)
+                if len(length_bytes) < 2:
+                    break
+                length, = struct.unpack('>H', length_bytes)
+                if kind == 0xE1 and taken is None and orientation is None:
+                    data = f.read(length - 2)
+                    if data[:6] == b'Exif\0\0':
+                        taken, orientation = parse_exif(data[6:])
+                elif 0xC0 <= kind <= 0xCF and kind not in (0xC4, 0xC8, 0xCC):
+                    frame = f.read(5)
+                    if len(frame) == 5:
+                        height, width = struct.unpack('>xHH', frame)
+                    break
+                else:
+                    f.seek(length - 2, os.SEEK_CUR)
+        elif head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR' and len(head) >= 24:
+            width, height = struct.unpack('>II', head[16:24])
+        elif head[:6] in (b'GIF87a', b'GIF89a') and len(head) >= 10:
+            width, height = struct.unpack('<HH', head[6:10])
+        elif head[:2] == b'BM' and len(head) >= 26:
+            if struct.unpack('<I', head[14:18])[0] == 12:
+                width, height = struct.unpack('<HH', head[18:22])
+            else:
+                width, height = struct.unpack('<ii', head[18:26])
+                height = abs(height)
+    if orientation in (5, 6, 7, 8) and width is not None:
+        width, height = height, width
+    return taken, width, height, orientation
+
+
+def index_photo(path):
+    """Read the metadata of one photo on the pool; returns None if the file could not be read.
+
+    A damaged header only costs a warning: the photo is indexed without metadata, so it is not read again.
+    """
+    try:
+        return read_image_metadata(path)
+    except OSError as e:
+        logger.warning(f"Could not read '{path}': {e}")
+        return None
+    except (struct.error, ValueError) as e:
+        logger.warning(f"Could not read the header of '{path}': {e}")
+        return None, None, None, None
+
+
+def update_metadata(conn, directory, workers=4):
+    """Bring the metadata index (capture date, size, orientation) of the catalogued files below directory up to date.
 
-            for file in files:
-                if any(file.lower().endswith(ext) for ext in valid_extensions):
-                    image_files.append(os.path.join(root, file))
+    Like hashes, metadata is cached by path, size and mtime. Only the headers are read, on a thread pool.
+    Photos without an EXIF capture date get the date of the file.
+    """
+    low, high = catalog_range(directory)
+    conn.execute("DELETE FROM metadata WHERE path >= ? AND path < ? AND path NOT IN (SELECT path FROM files)", (low, high))
+    todo = conn.execute("""
+        SELECT f.path, f.size, f.mtime_ns FROM files f LEFT JOIN metadata m ON m.path = f.path
+        WHERE f.path >= ? AND f.path < ? AND (m.path IS NULL OR m.size != f.size OR m.mtime_ns != f.mtime_ns)
+    """, (low, high)).fetchall()
+    if todo:
+        logger.info(f"Reading the headers of {len(todo)} new or changed photos...")
+        start_time = time.time()
+        indexed = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for (path, size, mtime_ns), result in zip(todo, pool.map(index_photo, [path for path, _, _ in todo])):
+                if result is None:
+                    continue
+                taken, width, height, orientation = result
+                if taken is None:
+                    taken = datetime.fromtimestamp(mtime_ns / 1e9).strftime('%Y-%m-%d %H:%M:%S')
+                conn.execute("INSERT OR REPLACE INTO metadata (path, size, mtime_ns, taken, width, height, orientation) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)", (path, size, mtime_ns, taken, width, height, orientation))
+                indexed += 1
+                if indexed % 1000 == 0:
+                    conn.commit()
+        logger.info(f"Indexed {indexed} photos in {time.time() - start_time:.1f}s.")
+    conn.commit()
 
+
+def policy_order(conn, candidates_sql, params, policy, seed=None):
+    """Run candidates_sql (rows starting with path and size) and order its rows by a selection policy.
+
+    Photos matching policy['name'] come first: 'on_this_day' (taken at least a year ago, within
+    on_this_day_days of today's date), 'recent' (taken in the last recent_months months), or all of them
+    for 'random' and 'balanced_folders'. Within each of these two groups, photos in policy['prefer_orientation']
+    ('landscape' or 'portrait') come first, then 'balanced_folders' takes one photo from every folder in
+    turn, and the rest is in random order (reproducible with a seed). Yields (path, size, matches).
+    """
+    matches = "1"
+    condition_params = []
+    if policy['name'] == 'on_this_day':
+        today = datetime.now()
+        days = {(today + timedelta(days=offset)).strftime('%m-%d') for offset in range(-policy['on_this_day_days'], policy['on_this_day_days'] + 1)}
+        try:
+            year_ago = today.replace(year=today.year - 1)
+        except ValueError:
+            year_ago = today.replace(year=today.year - 1, day=28)
+        # Compared as full dates, so late December does not count as a past year in early January
+        matches = f"substr(m.taken, 6, 5) IN ({', '.join('?' * len(days))}) AND m.taken < ?"
+        condition_params += [*sorted(days), (year_ago + timedelta(days=policy['on_this_day_days'] + 1)).strftime('%Y-%m-%d')]
+    elif policy['name'] == 'recent':
+        matches = "m.taken >= ?"
+        condition_params.append((datetime.now() - timedelta(days=round(policy['recent_months'] * 30.44))).strftime('%Y-%m-%d'))
+    preferred = {'landscape': "m.width > m.height", 'portrait': "m.height > m.width"}.get(policy['prefer_orientation'], "1")
+
+    if seed is None:
+        priority = "random()"
+    else:
+        # Shifted into SQLite's signed 64-bit range; same order as reservoir_sample()
+        conn.create_function("sample_priority", 1, lambda path: sample_priority(seed, path) >> 1, deterministic=True)
+        priority = "sample_priority(c.path)"
+    folder_rank = "ROW_NUMBER() OVER (PARTITION BY dir, matches, preferred ORDER BY priority), " if policy['name'] == 'balanced_folders' else ""
+
+    # Placeholders are bound in the order they appear, so the candidates come first
+    return conn.execute(f"""
+        WITH c AS ({candidates_sql}),
+        scored AS (
+            SELECT c.path AS path, c.size AS size, f.dir AS dir, COALESCE({matches}, 0) AS matches,
+                   COALESCE({preferred}, 0) AS preferred, {priority} AS priority
+            FROM c JOIN files f ON f.path = c.path LEFT JOIN metadata m ON m.path = c.path
+        )
+        SELECT path, size, matches FROM scored
+        ORDER BY matches DESC, preferred DESC, {folder_rank}priority
+    """, (*params, *condition_params))
+
+
+def describe_policy(policy):
+    """Short description of a selection policy for the output."""
+    descriptions = {
+        'random': "random choice",
+        'on_this_day': f"'on this day' (within {policy['on_this_day_days']} days, earlier years)",
+        'recent': f"'recent' (last {policy['recent_months']} months)",
+        'balanced_folders': "'balanced per folder'",
+    }
+    description = descriptions[policy['name']]
+    if policy['prefer_orientation']:
+        description += f", {policy['prefer_orientation']} first"
+    return description
+
+
+def sample_priority(seed, name):
+    """Seeded random priority of a name, independent of the order names are seen in."""
+    digest = hashlib.blake2b(f"{seed}\0{name}".encode('utf-8', 'surrogateescape'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def reservoir_sample(items, k, seed=None, key=None):
+    """Uniformly select up to k items from a stream in O(k) memory; returns (selected, number_seen).
+
+    Every item gets a random priority and the k smallest are kept (bottom-k sampling). With a seed the
+    priority is a hash of seed and key(item) (default: the item, normally a path), so the selection does
+    not depend on the order items arrive in.
+    """
+    rng = random.Random(seed)
+    heap = []  # max-heap on priority via negated keys
+    seen = 0
+    for item in items:
+        seen += 1
+        if seed is None:
+            priority = rng.random()
+        else:
+            priority = sample_priority(seed, key(item) if key else item)
+        if len(heap) < k:
+            heapq.heappush(heap, (-priority, item))
+        elif -heap[0][0] > priority:
+            heapq.heapreplace(heap, (-priority, item))
+    # Lowest priority first gives a random (and, when seeded, reproducible) upload order
+    return [item for _, item in sorted(heap, reverse=True)], seen
+
+
+@timed('scan', lambda result, *args, **kwargs: {'files': len(result)})
+def get_image_files(directory, max_file_size_mb, max_photos, catalog_path=None, rebuild_catalog=False, seed=None, workers=8, keep=None, sizes=None,
+                    refresh_catalog=True, dedupe=None, hash_workers=4, dedupe_distance=4, policy=None, metadata_workers=4, exclude=None):
+    """Recursively get all image files from a directory, skipping folders with a .nonixplay file.
+
+    When catalog_path is given, the directory tree is read through the on-disk catalog instead of a full rescan;
+    refresh_catalog=False uses the catalog as it is (when a watcher saw no changes since the last scan).
+    dedupe="content" (needs the catalog) counts identical files only once, preferring a copy in keep;
+    dedupe="perceptual" also collapses resized or re-encoded copies: images whose perceptual hashes differ
+    in at most dedupe_distance of 64 bits.
+    policy (needs the catalog) is a dict as built by load_job(): photos are then indexed by their headers on
+    metadata_workers threads and picked in the order of policy_order().
+    Candidates are streamed into a reservoir, so memory stays proportional to max_photos.
+    Paths in keep that are still eligible are always selected and the rest of max_photos is filled at random.
+    Paths in exclude (photos just rotated off the frame) are only selected when there are not enough others.
+    If a sizes dict is given, it is filled with the size in bytes of every selected file.
+    """
+    keep = set(keep or ())
+    kept = []
+    exclude = set(exclude or ())
+    excluded = []
+
+    def split_kept(candidates):
+        for path, size in candidates:
+            if path in keep:
+                kept.append((path, size))
+            elif path in exclude:
+                excluded.append((path, size))
+            else:
+                yield path, size
+
+    def path_of(candidate):
+        return candidate[0]
+
+    try:
         max_file_size = max_file_size_mb * 1024 * 1024
-        # Filter out large files
-        filtered_images = [f for f in image_files if os.path.getsize(f) <= max_file_size]
-        logger.debug(f"Filtered images: {len(filtered_images)} files below the {max_file_size_mb}MB limit.")
+        if catalog_path:
+            conn = open_catalog(catalog_path)
+            try:
+                root = os.path.abspath(directory)
+                if refresh_catalog or rebuild_catalog:
+                    update_catalog(conn, root, rebuild_catalog, workers)
+                if dedupe:
+                    perceptual = dedupe == 'perceptual'
+                    update_hashes(conn, root, hash_workers, perceptual)
+                    conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep (path TEXT PRIMARY KEY)")
+                    conn.executemany("INSERT OR IGNORE INTO temp.keep (path) VALUES (?)", [(path,) for path in keep])
+                    conn.execute("CREATE TEMP TABLE IF NOT EXISTS phash_groups (phash TEXT PRIMARY KEY, grp TEXT NOT NULL)")
+                    conn.execute("DELETE FROM temp.phash_groups")
+                    if perceptual:
+                        phashes = [phash for phash, in conn.execute(
+                            "SELECT DISTINCT phash FROM hashes WHERE phash != '' AND path >= ? AND path < ?", catalog_range(root))]
+                        conn.executemany("INSERT INTO temp.phash_groups (phash, grp) VALUES (?, ?)",
+                                         near_duplicate_groups(phashes, dedupe_distance).items())
+                    # One row per distinct photo: the copy to keep if there is one, else the first path.
+                    # SQLite takes the bare path and size columns from the row that wins MIN().
+                    candidates_sql = """
+                        SELECT f.path, f.size, MIN((k.path IS NULL) || f.path)
+                        FROM files f LEFT JOIN hashes h ON h.path = f.path LEFT JOIN temp.phash_groups g ON g.phash = h.phash
+                             LEFT JOIN temp.keep k ON k.path = f.path
+                        WHERE f.size <= ? AND f.path >= ? AND f.path < ?
+                        GROUP BY COALESCE(g.grp, h.digest, f.path)
+                    """
+                else:
+                    candidates_sql = "SELECT path, size FROM files WHERE size <= ? AND path >= ? AND path < ?"
+                params = (max_file_size, *catalog_range(root))
+                if policy:
+                    update_metadata(conn, root, metadata_workers)
+                    match_count = 0
+                    selected = []
+                    candidate_count = 0
+
+                    def count_matches(rows):
+                        nonlocal match_count
+                        for path, size, matches in rows:
+                            match_count += matches
+                            yield path, size
+
+                    # Rows arrive best first, so the selection is simply the head of the stream
+                    for candidate in split_kept(count_matches(policy_order(conn, candidates_sql, params, policy, seed))):
+                        if len(selected) < max_photos:
+                            selected.append(candidate)
+                        candidate_count += 1
+                    if policy['name'] in ('on_this_day', 'recent'):
+                        logger.info(f"{match_count} photos match the selection policy ({describe_policy(policy)}).")
+                else:
+                    rows = ((path, size) for path, size, *_ in conn.execute(candidates_sql, params))
+                    selected, candidate_count = reservoir_sample(split_kept(rows), max_photos, seed, path_of)
+                if dedupe:
+                    file_count = conn.execute("SELECT COUNT(*) FROM files WHERE size <= ? AND path >= ? AND path < ?",
+                                              (max_file_size, *catalog_range(root))).fetchone()[0]
+                    # Kept and excluded photos were split off the candidates, so they are no duplicates
+                    duplicate_count = file_count - candidate_count - len(kept) - len(excluded)
+                    logger.info(f"Found {duplicate_count} duplicate copies, each photo counts once.")
+            finally:
+                conn.close()
+        else:
+            candidates = ((path, size) for path, size in iter_image_files(os.path.abspath(directory), workers) if size <= max_file_size)
+            selected, candidate_count = reservoir_sample(split_kept(candidates), max_photos, seed, path_of)
+        if excluded:
+            shortfall = max_photos - len(kept) - len(selected)
+            if shortfall > 0:
+                selected += reservoir_sample(excluded, shortfall, seed, path_of)[0]
+            candidate_count += len(excluded)
+        if kept:
+            kept = reservoir_sample(kept, max_photos, seed, path_of)[0]
+            logger.info(f"Keeping {len(kept)} photos that are already in the playlist.")
+            selected = kept + selected[:max_photos - len(kept)]
+            candidate_count += len(kept)
+        selected_images = [path for path, _ in selected]
+        if sizes is not None:
+            sizes.update(selected)
+        logger.debug(f"Filtered images: {candidate_count} files below the {max_file_size_mb}MB limit.")
         
-        # Randomly select max_photos number of photos
-        import random
-        if len(filtered_images) > max_photos:
-            selected_images = random.sample(filtered_images, max_photos)
-            logger.info(f"Randomly selected {len(selected_images)} photos for upload.")
+        if candidate_count > max_photos and policy:
+            logger.info(f"Selected {len(selected_images)} of {candidate_count} photos for upload by {describe_policy(policy)}.")
+        elif candidate_count > max_photos:
+            logger.info(f"Randomly selected {len(selected_images)} of {candidate_count} photos for upload.")
         else:
-            selected_images = filtered_images
             logger.info(f"Selected all {len(selected_images)} photos for upload (fewer than max_photos).")
 
         return selected_images        
@@ -107,18 +1143,135 @@ def get_image_files(directory, max_file_size_mb, max_photos):
         exit(1)
 
 
-def setup_webdriver():
-    """Set up and configure Chrome WebDriver."""
+def preprocess_image(path, max_file_size, settings):
+    """Downsize and re-encode one image for the frame; runs in a worker process.
+
+    Returns (path, upload_path, error). Images that already fit the target size are uploaded as they are;
+    the others are re-encoded into the cache under a key made from the file content and the settings,
+    so an unchanged photo is never re-encoded on later runs.
+    """
+    from PIL import Image, ImageOps
+
+    try:
+        max_size = (settings['max_width'], settings['max_height'])
+        with Image.open(path) as img:
+            fits = img.width <= max_size[0] and img.height <= max_size[1]
+        if fits and os.path.getsize(path) <= max_file_size:
+            return path, path, None
+
+        digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode())
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        key = digest.hexdigest()
+        out_dir = os.path.join(settings['cache_dir'], key[:2], key)
+        out_path = os.path.join(out_dir, os.path.splitext(os.path.basename(path))[0] + '.jpg')
+        if os.path.exists(out_path):
+            return path, out_path, None
+
+        os.makedirs(out_dir, exist_ok=True)
+        with Image.open(path) as img:
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail(max_size, Image.LANCZOS)
+            tmp_path = out_path + '.tmp'
+            img.convert('RGB').save(tmp_path, 'JPEG', quality=settings['quality'], optimize=True)
+        os.replace(tmp_path, out_path)
+        return path, out_path, None
+    except Exception as e:
+        return path, None, str(e)
+
+
+@timed('preprocess', lambda result, paths, *args, **kwargs: {'files': len(paths)})
+def preprocess_images(paths, max_file_size_mb, settings, workers=None):
+    """Prepare images for upload on a process pool; returns {path: upload_path} for the images that can be uploaded."""
+    max_file_size = max_file_size_mb * 1024 * 1024
+    upload_paths = {}
+    reencoded = 0
+    start_time = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(preprocess_image, path, max_file_size, settings) for path in paths]
+        for future in futures:
+            path, upload_path, error = future.result()
+            if error:
+                logger.warning(f"Could not preprocess '{path}': {error}, skipping")
+            elif os.path.getsize(upload_path) > max_file_size:
+                logger.warning(f"'{path}' is still above {max_file_size_mb}MB after preprocessing, skipping")
+            else:
+                upload_paths[path] = upload_path
+                reencoded += upload_path != path
+    logger.info(f"Preprocessed {len(paths)} photos in {time.time() - start_time:.1f}s "
+                f"({reencoded} downsized, {len(paths) - len(upload_paths)} skipped).")
+    return upload_paths
+
+
+def resolve_chromedriver(cache_path=None, refresh=False):
+    """Return the chromedriver path, reusing the cached one while it still runs, so no network lookup is needed."""
+    from webdriver_manager.chrome import ChromeDriverManager
+
+    if cache_path and not refresh:
+        try:
+            with open(cache_path, 'r') as f:
+                cached_path = json.load(f)['path']
+            result = subprocess.run([cached_path, '--version'], capture_output=True, text=True, timeout=10)
+            if result.returncode == 0:
+                logger.debug(f"Using cached chromedriver {cached_path} ({result.stdout.strip()})")
+                return cached_path
+        except (OSError, ValueError, KeyError, subprocess.SubprocessError) as e:
+            logger.debug(f"Cached chromedriver not usable: {e}")
+
+    logger.info("Resolving chromedriver (needs network access)...")
+    driver_path = ChromeDriverManager().install()
+    if cache_path:
+        try:
+            with open(cache_path, 'w') as f:
+                json.dump({'path': driver_path}, f)
+        except OSError as e:
+            logger.warning(f"Could not cache chromedriver path in '{cache_path}': {e}")
+    return driver_path
+
+
+@timed('browser_start')
+def setup_webdriver(driver_cache_path=None, user_data_dir=None, memory_mb=None, lean=False, block_urls=(), remote_url=None):
+    """Set up and configure Chrome WebDriver.
+
+    driver_cache_path caches the resolved chromedriver between runs; user_data_dir keeps a persistent
+    Chrome profile so the login session survives between runs. memory_mb caps the JavaScript heap and
+    keeps Chrome to a single renderer process, for running several browsers side by side.
+
+    lean starts a lighter browser: no images (thumbnails), fonts, media or trackers (LEAN_BLOCKED_URLS plus
+    block_urls), the eager page load strategy (every step waits for the elements it needs anyway), a small
+    fixed window, no background services, and a 512MB memory cap unless memory_mb is given.
+
+    With remote_url, Chrome runs behind a Selenium server or Grid (e.g. in another container) instead of
+    being started here; user_data_dir is then a path on the browser's machine.
+    """
+    try:
+        from selenium import webdriver
+        from selenium.webdriver.chrome.service import Service
+        from selenium.webdriver.remote.file_detector import UselessFileDetector
+        from selenium.common.exceptions import SessionNotCreatedException
+    except ImportError as e:
+        logger.error(f"A browser is needed for this, but {e.name} is not installed (pip install -r requirements.txt).")
+        exit(1)
+
     try:
         options = webdriver.ChromeOptions()
-        options.add_argument("--start-maximized")
+        if lean:
+            options.add_argument("--window-size=1280,800")
+            for flag in LEAN_CHROME_FLAGS:
+                options.add_argument(flag)
+            # Blocked by resource type rather than URL, so uploads of .jpg files are never caught
+            options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+            memory_mb = memory_mb or 512
+        else:
+            options.add_argument("--start-maximized")
         options.add_argument("--disable-notifications")
         options.add_argument("--disable-extensions")
         options.add_argument("--disable-gpu")
         options.add_argument("--disable-dev-shm-usage")
         options.add_argument("--no-sandbox")
         options.add_argument("--ignore-certificate-errors")
-        options.page_load_strategy = 'normal'
+        options.page_load_strategy = 'eager' if lean else 'normal'
         
         # by defdault we want headless
         options.headless = True
@@ -128,18 +1281,144 @@ def setup_webdriver():
         
         # gemini
         options.add_argument("--silent")
+
+        if user_data_dir:
+            options.add_argument(f"--user-data-dir={user_data_dir if remote_url else os.path.abspath(user_data_dir)}")
+        if memory_mb:
+            options.add_argument(f"--js-flags=--max-old-space-size={memory_mb}")
+            options.add_argument("--renderer-process-limit=1")
         
-        service = Service(ChromeDriverManager().install())
-        driver = webdriver.Chrome(service=service, options=options)
+        if remote_url:
+            logger.info(f"Connecting to the remote browser at {remote_url}...")
+            driver = webdriver.Remote(command_executor=remote_url, options=options)
+            # upload_batch() copies files to the browser's machine itself; send_keys must not zip them up again
+            driver.file_detector = UselessFileDetector()
+        else:
+            service = Service(resolve_chromedriver(driver_cache_path))
+            try:
+                driver = webdriver.Chrome(service=service, options=options)
+            except SessionNotCreatedException as e:
+                if not driver_cache_path:
+                    raise
+                # Chrome was probably updated past the cached driver
+                logger.info(f"Cached chromedriver could not start Chrome ({e.msg}), resolving it again.")
+                service = Service(resolve_chromedriver(driver_cache_path, refresh=True))
+                driver = webdriver.Chrome(service=service, options=options)
         driver.set_page_load_timeout(60)
+        if lean:
+            # The Chrome DevTools command, which remote Chrome sessions also accept
+            driver.execute("executeCdpCommand", {"cmd": "Network.enable", "params": {}})
+            driver.execute("executeCdpCommand", {"cmd": "Network.setBlockedURLs", "params": {"urls": LEAN_BLOCKED_URLS + list(block_urls)}})
         return driver
     except Exception as e:
         logger.error(f"Failed setting up WebDriver: {str(e)}")
         exit(1)
 
 
+def process_tree_rss(pid):
+    """Resident memory in bytes of a process and all its descendants, or None where it cannot be read.
+
+    Uses psutil when installed, else /proc (Linux).
+    """
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            total = process.memory_info().rss
+            for child in process.children(recursive=True):
+                try:
+                    total += child.memory_info().rss
+                except psutil.NoSuchProcess:
+                    pass
+            return total
+        except psutil.Error:
+            return None
+    if not os.path.isdir('/proc'):
+        return None
+
+    children = {}
+    rss = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", 'r') as f:
+                # Fields after the parenthesised command name: state, ppid, ..., rss (in pages) at index 21
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+        rss[int(entry)] = int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+    if pid not in rss:
+        return None
+    total = 0
+    todo = [pid]
+    while todo:
+        current = todo.pop()
+        total += rss.get(current, 0)
+        todo.extend(children.get(current, []))
+    return total
+
+
+def browser_footprint(driver):
+    """Measure the page in the browser and the browser itself.
+
+    Returns page_load_s (last full page load, from the Navigation Timing API), resources and transfer_kb
+    (what the page downloaded) and rss_mb (resident memory of chromedriver and Chrome); None where unknown.
+    """
+    footprint = {'page_load_s': None, 'resources': None, 'transfer_kb': None, 'rss_mb': None}
+    try:
+        timing = driver.execute_script("""
+            var nav = performance.getEntriesByType('navigation')[0], resources = performance.getEntriesByType('resource');
+            return {load: nav ? (nav.loadEventEnd || nav.domContentLoadedEventEnd) : null, count: resources.length,
+                    bytes: resources.reduce(function (sum, r) { return sum + (r.transferSize || 0); }, nav ? nav.transferSize || 0 : 0)};
+        """)
+        if timing['load']:
+            footprint['page_load_s'] = round(timing['load'] / 1000, 3)
+        footprint['resources'] = timing['count']
+        footprint['transfer_kb'] = round(timing['bytes'] / 1024, 1)
+    except Exception as e:
+        logger.debug(f"Could not read page timing: {e}")
+    process = getattr(getattr(driver, 'service', None), 'process', None)
+    if process is not None:
+        rss = process_tree_rss(process.pid)
+        if rss is not None:
+            footprint['rss_mb'] = round(rss / 1024 / 1024, 1)
+    return footprint
+
+
+def format_measure(value, spec, unit=''):
+    """Format a measurement that may be unknown (None)."""
+    return "n/a" if value is None else format(value, spec) + unit
+
+
+def describe_footprint(footprint):
+    return (f"page loaded in {format_measure(footprint['page_load_s'], '.2f', 's')} with {format_measure(footprint['resources'], 'd')} "
+            f"resources ({format_measure(footprint['transfer_kb'], '.0f', ' KB')}), Chrome using {format_measure(footprint['rss_mb'], '.0f', ' MB')}")
+
+
+def page_call(driver, function, *args):
+    """Call a function of the in-page helper (PAGE_HELPER_JS) in one round trip.
+
+    The helper is installed on first use in each page load; later calls only send the function name and arguments.
+    """
+    result = driver.execute_script(PAGE_CALL_JS, function, list(args))
+    if result == '__nixUpload missing':
+        result = driver.execute_script(PAGE_HELPER_JS + PAGE_CALL_JS, function, list(args))
+    return result
+
+
+@timed('login')
 def login_to_nixplay(driver, base_url, username, password):
     """Log in to Nixplay account."""
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import TimeoutException
+
     try:
         logger.debug("Logging in to Nixplay...")
         login_url = f"{base_url}/login"
@@ -172,15 +1451,36 @@ def login_to_nixplay(driver, base_url, username, password):
         return True
     except TimeoutException:
         logger.error("Timeout while trying to log in.")
-        save_debug_snapshot(driver, "login_failed_timeout")
+        save_debug_snapshot(driver, "login_failed_timeout", error=True)
         return False
     except Exception as e:
         logger.error(f"Failed to login: {str(e)}")
-        save_debug_snapshot(driver, "login_failed_exception")
+        save_debug_snapshot(driver, "login_failed_exception", error=True)
+        return False
+
+def has_valid_session(driver, base_url, timeout=15):
+    """Check whether the browser is still logged in (persistent profile), by opening the playlists page."""
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.common.exceptions import TimeoutException
+
+    def page_shown(d):
+        state = page_state(d)
+        return state if '/login' in state['url'] or state['loginForm'] or state['playlists'] else None
+
+    try:
+        driver.get(f"{base_url}/#/playlists")
+        state = WebDriverWait(driver, timeout).until(page_shown)
+        return '/login' not in state['url'] and not state['loginForm']
+    except TimeoutException:
         return False
 
+
+@timed('find_playlist')
 def find_playlist(driver, base_url, playlist_name):
     """Find and select the specified playlist by name, then index."""
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
     try:
         logger.debug(f"Finding playlist: {playlist_name}...")
         playlists_url = f"{base_url}/#/playlists"
@@ -188,25 +1488,13 @@ def find_playlist(driver, base_url, playlist_name):
 
         wait = WebDriverWait(driver, 30)
 
-        # Find the playlist's name element.
-        playlist_name_element = wait.until(
-            EC.presence_of_element_located((By.XPATH, f'//span[@class="name" and @title="{playlist_name}"]'))
-        )
-
-        # Find the parent playlist container and extract the index from the ID.
-        playlist_container = playlist_name_element.find_element(By.XPATH, "./ancestor::div[contains(@id, 'playlist-')]")
-        playlist_id = playlist_container.get_attribute("id")
-        playlist_index = int(re.search(r'\d+', playlist_id).group()) #extract the digits
+        # Find the playlist's name element, take the index from its container's ID and click the container's
+        # draggable wrapper, in one round trip per poll.
+        opened = wait.until(lambda d: page_call(d, 'openPlaylist', playlist_name))
+        playlist_index = opened['index']
 
         logger.info(f"Found playlist '{playlist_name}' with index: {playlist_index}")
 
-        # Find the playlist's clickable element using the index.
-        playlist_element = wait.until(
-            EC.element_to_be_clickable((By.XPATH, f'//div[@id="playlist-{playlist_index}"]//div[@class="playlist-draggable-wrapper"]'))
-        )
-
-        playlist_element.click()
-
         wait.until(EC.url_contains("/playlist/"))
         save_debug_snapshot(driver, f"playlist_selected_{playlist_name}")
         return True
@@ -214,7 +1502,7 @@ def find_playlist(driver, base_url, playlist_name):
     except Exception as e:
         logger.error(f"Could not find playlist: {repr(e)}")
         traceback.print_exc()
-        save_debug_snapshot(driver, "find_playlist_error")
+        save_debug_snapshot(driver, "find_playlist_error", error=True)
         return False
 
 
@@ -225,80 +1513,320 @@ def find_playlist(driver, base_url, playlist_name):
 # from selenium.webdriver.support.ui import WebDriverWait
 # from selenium.webdriver.support import expected_conditions as EC
 
-def delete_all_photos(driver, timeout=10):
-    from selenium.webdriver.common.by import By
+def page_state(driver):
+    """Page state from the helper, read with the configured page_hooks."""
+    return page_call(driver, 'state', page_hooks['photo_item_css'], page_hooks['photo_list_css'], page_hooks['photo_count_css'])
+
+
+def shown_playlist_state(driver):
+    """Page state once the playlist view and its photo list have rendered, else None (for WebDriverWait)."""
+    state = page_state(driver)
+    return state if state['playlistShown'] and state['photoListShown'] else None
+
+
+def shown_photo_count(state, items_seen=False):
+    """Number of photos the playlist page shows, or None when it cannot be told.
+
+    A count printed on the page (photo_count_css) is used when there is one. Otherwise the photo items are
+    counted, but no items only means an empty playlist when items_seen says photo_item_css has matched
+    photos on this page before; else the selector may just not fit the page.
+    """
+    if state['reportedCount'] is not None:
+        return state['reportedCount']
+    if not state['photoListShown'] or not (state['photoCount'] or items_seen):
+        return None
+    return state['photoCount']
+
+
+def wait_for_photo_count(driver, target, timeout=600, items_seen=False, unknown_timeout=30):
+    """Wait until the site holds at most target photos in the open playlist; returns the count, or None on timeout.
+
+    Deleting is finished on the server after the page has been answered, so the count is read from a fresh
+    load of the playlist. Reloads back off from 1 to 15 seconds apart, so a long delete costs few of them.
+    A count that cannot be read (see shown_photo_count) never confirms the delete; after unknown_timeout
+    seconds of that the wait gives up.
+    """
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.common.exceptions import TimeoutException
+
+    def at_most_target(d):
+        count = shown_photo_count(page_state(d), items_seen)
+        return count is not None and count <= target
+
+    start_time = time.time()
+    # Give the page a moment to send the delete and show the result; reloading right away could cancel the request
+    try:
+        WebDriverWait(driver, min(timeout, 2), poll_frequency=0.5).until(at_most_target)
+    except TimeoutException:
+        pass
+
+    delay = 1.0
+    unknown_since = None
+    while True:
+        driver.refresh()
+        try:
+            count = shown_photo_count(WebDriverWait(driver, 30).until(shown_playlist_state), items_seen)
+        except TimeoutException:
+            logger.error(f"The playlist page did not show its photo list ('{page_hooks['photo_list_css']}'); "
+                         f"check photo_list_css in config.json.")
+            save_debug_snapshot(driver, "photo_list_not_shown", error=True)
+            return None
+        if count is not None and count <= target:
+            logger.debug(f"Playlist holds {count} photos after {time.time() - start_time:.1f}s.")
+            return count
+        if count is None:
+            unknown_since = unknown_since or time.time()
+            if time.time() - unknown_since >= unknown_timeout:
+                logger.warning(f"Could not tell whether Nixplay has finished deleting: the playlist page shows no photos matching "
+                             f"'{page_hooks['photo_item_css']}'. Set photo_count_css, or check photo_item_css, in config.json.")
+                save_debug_snapshot(driver, "photo_count_unknown", error=True)
+                return None
+        else:
+            unknown_since = None
+        remaining = start_time + timeout - time.time()
+        if remaining <= 0:
+            logger.error(f"Playlist still holds {count} photos after {timeout:.0f}s, expected at most {target}.")
+            save_debug_snapshot(driver, "delete_not_finished", error=True)
+            return None
+        logger.debug(f"Playlist holds {'an unknown number of' if count is None else count} photos, waiting for at most {target}; "
+                     f"checking again in {delay:.0f}s.")
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 15)
+
+
+def delete_selected(driver, names, count, wait, delete_timeout=600):
+    """Tick the photos with these names, delete them and wait until the server has removed them.
+
+    count is the number of photos in the playlist before. Returns the count after, or None when the delete
+    could not be started or did not finish within delete_timeout seconds.
+    """
+    selection = page_call(driver, 'selectPhotos', page_hooks['photo_item_css'], page_hooks['photo_select_css'], names)
+    if selection['missing']:
+        logger.warning(f"{len(selection['missing'])} photos to delete are not in the playlist (e.g. '{selection['missing'][0]}').")
+        return None
+    logger.debug(f"Selected {selection['selected']} photos for deletion.")
+
+    wait.until(lambda d: page_call(d, 'clickMenuItem', [page_hooks['delete_selected_action']]))
+    save_debug_snapshot(driver, "after_delete_selected_clicked")
+    wait.until(lambda d: page_call(d, 'clickButton', 'Yes'))
+    # The selection found the photos, so photo_item_css fits this page and an empty list can be trusted
+    return wait_for_photo_count(driver, count - len(names), delete_timeout, items_seen=True)
+
+
+@timed('delete_all')
+def delete_all_photos(driver, timeout=10, chunk_size=500, delete_timeout=600):
+    """Delete every photo in the current playlist and wait until the server has removed them all.
+
+    Playlists with more than chunk_size photos are emptied chunk_size photos at a time, each chunk
+    confirmed before the next, so no single delete has to remove thousands of photos.
+    """
     from selenium.webdriver.support.ui import WebDriverWait
-    from selenium.webdriver.support import expected_conditions as EC
     from selenium.common.exceptions import TimeoutException
-    import time
 
     try:
         logger.debug("Switching to main document...")
         driver.switch_to.default_content()
         wait = WebDriverWait(driver, timeout)
+        delete_start_time = time.time()
 
+        # Only 'Add photos' is known to be on nixplay.com's playlist page; the photo list and count come from
+        # the unverified page_hooks, so the delete goes ahead without them and they only serve to confirm it
+        wait.until(lambda d: page_state(d)['playlistShown'])
+        try:
+            state = WebDriverWait(driver, min(timeout, 5)).until(shown_playlist_state)
+        except TimeoutException:
+            state = page_state(driver)
+        items_seen = state['photoCount'] > 0
+        count = shown_photo_count(state, items_seen)
+        if chunk_size and count is not None and count > chunk_size and items_seen:
+            logger.info(f"Deleting {count} photos in chunks of {chunk_size}...")
+            while count > 0:
+                count = delete_selected(driver, sorted(set(state['photoNames'][:chunk_size])), count, wait, delete_timeout)
+                if count is None:
+                    logger.warning("Deleting in chunks failed, deleting all remaining photos at once.")
+                    driver.refresh()
+                    count = shown_photo_count(wait.until(shown_playlist_state), items_seen)
+                    break
+                logger.info(f"{count} photos left in the playlist.")
+                state = page_state(driver)
+            else:
+                logger.info(f"Deleted all photos in {time.time() - delete_start_time:.1f}s.")
+                return True
 
-        # Step 2: Open Actions dropdown
-        logger.debug("Locating and clicking Actions button...")
-        actions_button = wait.until(
-            EC.element_to_be_clickable((By.XPATH, "//button[contains(@class, 'dropdown-toggle') and contains(@class, 'btn-gray')]"))
-        )
-        actions_button.click()
-        logger.debug("Clicked Actions button.")
-        save_debug_snapshot(driver, "after_actions_clicked")
-
-        # Step 3: Click "Permanent delete all photos"
-        logger.debug("Clicking 'Permanent delete all photos'...")
-        delete_all_perm = wait.until(
-            EC.element_to_be_clickable((By.XPATH, "//a[contains(@ng-click, 'deleteAllSlides') and contains(@ng-click, 'delete')]"))
-        )
-        delete_all_perm.click()
+        # Step 2 and 3: Open Actions dropdown and click "Permanent delete all photos"
+        logger.debug("Opening Actions menu and clicking 'Permanent delete all photos'...")
+        wait.until(lambda d: page_call(d, 'clickMenuItem', ['deleteAllSlides', 'delete']))
         logger.debug("Clicked 'Permanent delete all photos'.")
         save_debug_snapshot(driver, "after_delete_all_clicked")
 
         # Step 4: Wait for modal and read title
         logger.debug("Waiting for modal to appear...")
-        modal_title_elem = wait.until(
-            EC.visibility_of_element_located((By.CSS_SELECTOR, ".nix-modal-title-text"))
-        )
-        modal_text = modal_title_elem.text.strip()
+        modal_text = wait.until(lambda d: page_call(d, 'modalTitle'))
         logger.debug(f"Modal title detected: '{modal_text}'")
         save_debug_snapshot(driver, "modal_detected")
 
         if modal_text == "No Photo in Playlist":
             logger.debug("'No Photo in Playlist' modal detected.")
-            ok_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[normalize-space()='OK']")))
             save_debug_snapshot(driver, "before_clicking_ok")
-            ok_button.click()
+            wait.until(lambda d: page_call(d, 'clickButton', 'OK'))
             logger.info("Clicked 'OK' on No Photo modal.")
             return True
         else:
             logger.debug("Confirmation modal detected (not 'No Photo'). Proceeding to click 'Yes'.")
             save_debug_snapshot(driver, "before_clicking_yes")
-            yes_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[normalize-space()='Yes']")))
-            yes_button.click()
+            wait.until(lambda d: page_call(d, 'clickButton', 'Yes'))
             logger.info("Clicked 'Yes' to confirm deletion.")
+
+        # Step 5: Wait until the server has removed the photos, so uploads start from an empty playlist. A count
+        # the page hooks cannot read leaves the delete unconfirmed, which is no reason to call it failed.
+        if count is None:
+            logger.warning("Could not confirm that Nixplay has finished deleting: the playlist page shows no photo count. "
+                           "Set photo_count_css, or check photo_item_css and photo_list_css, in config.json.")
             return True
+        if wait_for_photo_count(driver, 0, delete_timeout, items_seen) is None:
+            if shown_photo_count(page_state(driver), items_seen) is None:
+                logger.warning("Clicked 'Yes', but could not confirm that Nixplay has finished deleting.")
+                return True
+            return False
+        logger.info(f"Deleted {count} photos in {time.time() - delete_start_time:.1f}s.")
+        return True
 
     except TimeoutException as e:
         logger.error(f"delete_all_photos() TimeoutException: {str(e)}")
-        save_debug_snapshot(driver, "timeout_exception")
+        save_debug_snapshot(driver, "timeout_exception", error=True)
         return False
 
     except Exception as e:
         logger.error(f"delete_all_photos() Exception: {str(e)}")
-        save_debug_snapshot(driver, "unexpected_exception")
+        save_debug_snapshot(driver, "unexpected_exception", error=True)
         return False
 
-      
 
-       
+@timed('delete', lambda result, driver, names, *args, **kwargs: {'files': len(names)})
+def delete_photos(driver, names, timeout=10, chunk_size=500, delete_timeout=600):
+    """Delete only the photos with the given file names from the current playlist, leaving the others in place.
+
+    Deletes chunk_size photos at a time and waits for each chunk to be removed on the server.
+    """
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    try:
+        driver.switch_to.default_content()
+        wait = WebDriverWait(driver, timeout)
+        names = sorted(set(names))
+
+        logger.debug("Reading photos in the playlist...")
+        photo_names = wait.until(playlist_photo_names)
+        missing = set(names).difference(photo_names)
+        if missing:
+            logger.warning(f"{len(missing)} photos to delete are not in the playlist (e.g. '{min(missing)}').")
+            return False
+
+        count = len(photo_names)
+        chunk_size = chunk_size or len(names)
+        for start in range(0, len(names), chunk_size):
+            # Checking the names and ticking every select box of a chunk is one round trip, however many photos there are
+            count = delete_selected(driver, names[start:start + chunk_size], count, wait, delete_timeout)
+            if count is None:
+                return False
+        logger.info(f"Deleted {len(names)} photos from the playlist.")
+        return True
+
+    except Exception as e:
+        logger.error(f"delete_photos() Exception: {str(e)}")
+        save_debug_snapshot(driver, "delete_photos_exception", error=True)
+        return False
+
+
+def read_journal(journal_path):
+    """Read the upload journal of the last run.
+
+    Returns its start record with 'completed' (files of the batches that finished) and 'done' added,
+    or None when there is no journal.
+    """
+    try:
+        f = open(journal_path, 'r', encoding='utf-8')
+    except FileNotFoundError:
+        return None
+    start = None
+    with f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Ignoring torn record at the end of journal '{journal_path}'.")
+                break
+            if record['event'] == 'start':
+                start = dict(record, completed=[], done=False)
+            elif start is not None and record['event'] == 'batch':
+                start['completed'].extend(record['files'])
+            elif start is not None and record['event'] == 'done':
+                start['done'] = True
+    return start
+
+
+def open_journal(journal_path, start_record=None):
+    """Open the upload journal for appending; a start_record begins a new run and replaces the old journal."""
+    f = open(journal_path, 'w' if start_record else 'a', encoding='utf-8')
+    if start_record:
+        append_journal(f, dict(start_record, event='start'))
+    return f
+
+
+def append_journal(f, record):
+    """Append one record to the journal and fsync it, so it survives a crash right after this returns."""
+    f.write(json.dumps(record) + "\n")
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def manifest_key(base_url, username, playlist_name):
+    """Key identifying one playlist of one account in the upload manifest."""
+    return f"{base_url}|{username}|{playlist_name}"
+
+
+def load_manifest(manifest_path):
+    """Load the upload manifest: {playlist_key: {"photos": {local_path: uploaded_name}}}."""
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Ignoring unreadable manifest '{manifest_path}': {e}")
+        return {}
+
+
+def save_manifest(manifest_path, manifest):
+    """Write the upload manifest atomically so an interrupted run never leaves it half-written."""
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+
+def plan_sync(playlist_photos, selected_images):
+    """Work out the delta between what is in the playlist and the new selection.
+
+    Returns (names_to_delete, files_to_upload), or None when the playlist cannot be updated in place
+    because a photo to delete shares its file name with one that stays.
+    """
+    selected = set(selected_images)
+    to_delete = [name for path, name in playlist_photos.items() if path not in selected]
+    to_upload = [path for path in selected_images if path not in playlist_photos]
+    staying = {name for path, name in playlist_photos.items() if path in selected}
+    staying.update(os.path.basename(path) for path in to_upload)
+    if staying.intersection(to_delete):
+        return None
+    return to_delete, to_upload
+
 
 class invisibility_of_any_element:
     def __init__(self, locators):
         self.locators = locators
 
     def __call__(self, driver):
+        from selenium.webdriver.support import expected_conditions as EC
         return all(EC.invisibility_of_element_located(locator)(driver) for locator in self.locators)
 
 import json
@@ -308,15 +1836,301 @@ import os
 import time
 import random
 import traceback
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import ElementClickInterceptedException
 
-def upload_batch(driver, batch, batch_number, batch_count, batch_end_count, logfile):
+class BatchScheduler:
+    """Cut the upload list into batches by a byte budget that adapts to the measured throughput.
+
+    Each batch holds files in order up to budget_bytes and at most max_files. After every batch the budget
+    grows additively, halves when a batch failed, stalled or timed out, and falls back toward the budget that
+    gave the best throughput when bigger batches stop paying off (AIMD). Without a budget, batches are
+    max_files long.
+
+    Files that did not land are handed back with requeue() and go into later batches after an exponential
+    backoff, ahead of the files not tried yet; after max_retries attempts they end up in self.failed.
+    """
+
+    def __init__(self, files, sizes, max_files, budget_bytes=None, min_bytes=None, max_bytes=None, max_retries=3, retry_backoff=10):
+        self.files = list(files)
+        self.sizes = sizes
+        self.max_files = max_files
+        self.budget_bytes = budget_bytes
+        self.min_bytes = min_bytes or (budget_bytes // 8 if budget_bytes else None)
+        self.max_bytes = max_bytes or (budget_bytes * 8 if budget_bytes else None)
+        self.step_bytes = budget_bytes // 4 if budget_bytes else None
+        self.position = 0
+        self.peak_rate = 0.0
+        self.peak_budget = budget_bytes
+        self.batches_done = 0
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.attempts = {}
+        self.retries = []  # (due time, path), waiting out their backoff
+        self.ready = []  # retries whose backoff is over
+        self.failed = []
+
+    def pending(self):
+        return self.ready + [path for _, path in self.retries] + self.files[self.position:]
+
+    def remaining_bytes(self):
+        return sum(self.sizes[path] for path in self.pending())
+
+    def estimated_batch_count(self):
+        """Batches so far plus the batches the rest would need at the current budget."""
+        remaining = len(self.pending())
+        if not remaining:
+            return self.batches_done
+        estimate = -(-remaining // self.max_files)
+        if self.budget_bytes:
+            estimate = max(estimate, -(-self.remaining_bytes() // self.budget_bytes))
+        return self.batches_done + estimate
+
+    def next_batch(self):
+        """Return the next batch (always at least one file), or an empty list when nothing is ready to go.
+
+        An empty list with retry_wait() not None means retries are still backing off.
+        """
+        now = time.time()
+        self.ready.extend(path for due, path in self.retries if due <= now)
+        self.retries = [(due, path) for due, path in self.retries if due > now]
+
+        batch = []
+        batch_bytes = 0
+        while len(batch) < self.max_files and (self.ready or self.position < len(self.files)):
+            path = self.ready[0] if self.ready else self.files[self.position]
+            size = self.sizes[path]
+            if batch and self.budget_bytes and batch_bytes + size > self.budget_bytes:
+                break
+            if self.ready:
+                self.ready.pop(0)
+            else:
+                self.position += 1
+            batch.append(path)
+            batch_bytes += size
+        return batch
+
+    def retry_wait(self):
+        """Seconds until the next retry is due, or None when no retries are waiting."""
+        if not self.retries:
+            return None
+        return max(0.0, min(due for due, _ in self.retries) - time.time())
+
+    def requeue(self, paths):
+        """Schedule files that did not land for another attempt after a backoff."""
+        for path in paths:
+            attempts = self.attempts.get(path, 0) + 1
+            self.attempts[path] = attempts
+            if attempts > self.max_retries:
+                self.failed.append(path)
+            else:
+                self.retries.append((time.time() + self.retry_backoff * 2 ** (attempts - 1), path))
+
+    def record(self, batch, elapsed, completed):
+        """Feed back how a batch went and adjust the budget for the next one; returns the batch rate in bytes/s."""
+        self.batches_done += 1
+        batch_bytes = sum(self.sizes[path] for path in batch)
+        rate = batch_bytes / max(elapsed, 1e-3)
+        budget = self.budget_bytes
+        if completed and rate > self.peak_rate:
+            self.peak_rate = rate
+            self.peak_budget = budget
+        if budget:
+            if not completed:
+                self.budget_bytes = max(self.min_bytes, budget // 2)
+            elif rate < 0.8 * self.peak_rate and budget > self.peak_budget:
+                self.budget_bytes = max(self.peak_budget, budget // 2)
+            else:
+                self.budget_bytes = min(self.max_bytes, budget + self.step_bytes)
+        return rate
+
+
+def playlist_photo_names(driver):
+    """Return the file names of the photos shown on the playlist page, in one round trip."""
+    return page_state(driver)['photoNames']
+
+
+def find_missing_files(driver, batch, landed_count, earlier_names=None):
+    """Work out which files of a batch did not land in the playlist; returns (missing files, reloaded).
+
+    The site's completed count (landed_count, None if unknown) only tells how many files are missing: the
+    uploader sends several files at once, so a failure can be anywhere in the batch. Which ones is read from
+    the photo names of the playlist, but only when every file name of the batch is unique in it and not among
+    earlier_names (photos that were in the playlist before the batch, None if unknown): camera names like
+    IMG_0001.JPG repeat across folders. The names on the page are tried first; the playlist is only reloaded
+    when they do not add up, and reloaded tells the caller so, as a reload restarts the site's counter.
+    If the names cannot settle it, the whole batch counts as missing rather than guessing.
+    """
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    missing_count = None if landed_count is None else min(len(batch), max(0, len(batch) - landed_count))
+    if missing_count == 0:
+        return [], False
+    batch_names = [os.path.basename(path) for path in batch]
+    if earlier_names is None or len(set(batch_names)) < len(batch_names) or set(batch_names) & earlier_names:
+        logger.debug("File names of the batch are not unique in the playlist; cannot tell which photos landed.")
+        return list(batch), False
+
+    def missing_from(names):
+        names = set(names)
+        return [path for path, name in zip(batch, batch_names) if name not in names]
+
+    if missing_count is not None:
+        try:
+            state = page_state(driver)
+            missing = missing_from(state['photoNames'])
+            if state['photoListShown'] and len(missing) == missing_count:
+                return missing, False
+        except Exception as e:
+            logger.debug(f"Could not read playlist photo names: {e}")
+    try:
+        driver.refresh()
+        missing = missing_from(WebDriverWait(driver, 30).until(shown_playlist_state)['photoNames'])
+    except Exception as e:
+        logger.debug(f"Could not read playlist photo names: {e}")
+        return list(batch), True
+    if missing_count is not None and len(missing) != missing_count:
+        logger.debug(f"The playlist misses {len(missing)} photos of the batch by name but {missing_count} by the site's count.")
+        return list(batch), True
+    return missing, True
+
+
+# Resolves (through the async callback) as soon as the upload counter changes, reaches the target or
+# disappears, or when no progress was seen for the stall time or the maximum time is used up.
+# Arguments: counter xpath, last progress seen, target count, stall ms, maximum ms.
+WATCH_UPLOAD_PROGRESS_JS = """
+var xpath = arguments[0], lastSeen = arguments[1], target = arguments[2];
+var stallMs = arguments[3], maxMs = arguments[4], done = arguments[arguments.length - 1];
+var finished = false, timers = [], observer;
+
+function read() {
+    var el = document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    if (!el) return null;
+    var text = el.textContent.trim(), m = text.match(/(\\d+)\\s+of\\s+(\\d+)/);
+    return {text: text, progress: m ? parseInt(m[1], 10) : 0, total: m ? parseInt(m[2], 10) : 0};
+}
+
+function finish(state, info) {
+    if (finished) return;
+    finished = true;
+    observer.disconnect();
+    timers.forEach(clearTimeout);
+    info = info || {text: '', progress: lastSeen, total: 0};
+    info.state = state;
+    done(info);
+}
+
+function check() {
+    var info = read();
+    if (!info) return finish('closed');
+    if (info.progress >= target) return finish('done', info);
+    if (info.progress !== lastSeen) return finish('progress', info);
+}
+
+observer = new MutationObserver(check);
+observer.observe(document.body, {childList: true, subtree: true, characterData: true});
+timers.push(setTimeout(function () { finish('stalled', read()); }, stallMs));
+timers.push(setTimeout(function () { finish('timeout', read()); }, maxMs));
+check();
+"""
+
+# Remote WebDriver sessions that files were copied into. The copies stay in the session's temporary folder on
+# the browser's machine until the session ends, so run_daemon() ends these sessions after each rotation.
+copied_to_sessions = set()
+
+
+def stream_file_to_node(driver, path, remote_url, chunk_size=48 * 1024):
+    """Copy a file to the remote browser's machine through the WebDriver file endpoint; returns its path there.
+
+    Sends what send_keys does for a remote driver (a zip archive, base64 encoded in a JSON body), but the
+    archive is written to a temporary file and sent in chunks, so memory use does not grow with the file size.
+    """
+    import base64
+    import http.client
+    import tempfile
+    import zipfile
+
+    url = urllib.parse.urlsplit(f"{remote_url.rstrip('/')}/session/{driver.session_id}/se/file")
+    copied_to_sessions.add(driver.session_id)
+    with tempfile.TemporaryFile() as archive:
+        # Photos are compressed already, so they are stored rather than deflated
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as zipped:
+            zipped.write(path, os.path.basename(path))
+        archive_size = archive.seek(0, os.SEEK_END)
+        archive.seek(0)
+
+        prefix, suffix = b'{"file": "', b'"}'
+        headers = {'Content-Type': 'application/json; charset=utf-8',
+                   'Content-Length': str(len(prefix) + 4 * -(-archive_size // 3) + len(suffix))}
+        if url.username:
+            credentials = f"{urllib.parse.unquote(url.username)}:{urllib.parse.unquote(url.password or '')}"
+            headers['Authorization'] = 'Basic ' + base64.b64encode(credentials.encode()).decode()
+        connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        connection = connection_class(url.hostname, url.port, timeout=300)
+        try:
+            connection.putrequest('POST', url.path)
+            for name, value in headers.items():
+                connection.putheader(name, value)
+            connection.endheaders()
+            connection.send(prefix)
+            # chunk_size is a multiple of 3, so the encoded chunks join up into one base64 string
+            while True:
+                chunk = archive.read(chunk_size)
+                if not chunk:
+                    break
+                connection.send(base64.b64encode(chunk))
+            connection.send(suffix)
+            response = connection.getresponse()
+            status, body = response.status, response.read()
+        finally:
+            connection.close()
+
+    try:
+        value = json.loads(body)['value']
+    except (ValueError, KeyError, TypeError):
+        value = body[:200]
+    if status != 200 or not isinstance(value, str):
+        raise RuntimeError(f"Copying '{path}' to the remote browser failed (HTTP {status}): {value}")
+    return value
+
+
+def remote_file_path(driver, path, remote_url, path_map):
+    """Path under which a remote browser can open a local file.
+
+    Files below a local directory of path_map ({local directory: the same directory on the browser's machine},
+    e.g. a shared volume) are only renamed; others are copied over with stream_file_to_node().
+    """
+    path = os.path.abspath(path)
+    for local_dir, remote_dir in path_map.items():
+        local_dir = os.path.join(os.path.abspath(local_dir), '')
+        if path.startswith(local_dir):
+            return remote_dir.rstrip('/') + '/' + os.path.relpath(path, local_dir).replace(os.sep, '/')
+    return stream_file_to_node(driver, path, remote_url)
+
+
+def describe_upload_batch(result, driver, batch, *args, **kwargs):
+    """Span attributes of an upload_batch() call; batches that did not finish cleanly are counted as events."""
+    state = result[0]
+    if state != 'done':
+        metrics.event(f"batch_{state or 'not_sent'}")
+    return {'ok': state in ('done', 'closed'), 'state': state, 'files': len(batch),
+            'bytes': sum(os.path.getsize(path) for path in batch if os.path.exists(path))}
+
+
+@timed('upload_batch', describe_upload_batch)
+def upload_batch(driver, batch, batch_number, batch_count, batch_end_count, remote_url=None, remote_path_map=None):
     logger.debug(f"batch_number={batch_number}, batch_end_count={batch_end_count}")
     
-    """Upload a single batch of photos and monitor progress."""
+    """Upload a single batch of photos and monitor progress.
+
+    Returns (state, progress). state is None if the files were never sent, 'no_progress' if the progress
+    indicator never showed, otherwise how monitoring ended: 'done' (target reached), 'closed' (progress
+    indicator gone), 'stalled' or 'timeout'. progress is the last "N of M files completed" count seen, or None.
+    With remote_url, the files are made available to the remote browser first (see remote_file_path()).
+    """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import TimeoutException
+
     wait = WebDriverWait(driver, 120)
     
     # Display all file names in this batch
@@ -326,42 +2140,34 @@ def upload_batch(driver, batch, batch_number, batch_count, batch_end_count, logf
     
     
     
-    # Click "Add photos"
-    try:
-        wait.until(EC.invisibility_of_element_located((By.CSS_SELECTOR, ".nix-upload-modal-bg")))
-        add_photos_button = wait.until(EC.element_to_be_clickable((By.ID, "add-photos")))
-        driver.execute_script("arguments[0].scrollIntoView(true);", add_photos_button)
-        driver.execute_script("arguments[0].click();", add_photos_button)
-    except Exception as e:
-        logger.warning(f"❌ Error clicking 'Add photos': {e}, continuing")
-        save_debug_snapshot(driver, f"add_photos_error_batch_{batch_number}")
-        return False
-        
-    # Click "From my computer"
+    # Wait for the last upload dialog to close, click "Add photos" and "From my computer" and find the file
+    # input, in one round trip per poll
+    start = {}
+    def start_upload(d):
+        start.update(page_call(d, 'startUpload', not start))
+        return start.get('input')
     try:
-        from_computer = wait.until(EC.presence_of_element_located((By.XPATH, "//span[text()='From my computer']")))
-        driver.execute_script("arguments[0].click();", from_computer)
+        file_input = wait.until(start_upload)
     except Exception as e:
-        logger.warning(f"❌ Error clicking 'From my computer': {e}, continuing")
-        save_debug_snapshot(driver, f"from_my_computer_error_batch_{batch_number}")
-        return False
+        logger.warning(f"❌ Error opening the upload dialog (waiting for {start.get('waiting', 'the page')}): {e}, continuing")
+        save_debug_snapshot(driver, f"add_photos_error_batch_{batch_number}", error=True)
+        return None, None
         
     # Upload files
     try:
-        file_input = wait.until(EC.presence_of_element_located((By.ID, "upload")))
         # Debug print: List of files to be sent
-        files_to_send = "\n".join([os.path.abspath(f) for f in batch])
+        if remote_url:
+            # One file at a time, so memory use does not grow with the batch
+            files_to_send = "\n".join(remote_file_path(driver, f, remote_url, remote_path_map or {}) for f in batch)
+        else:
+            files_to_send = "\n".join([os.path.abspath(f) for f in batch])
         logger.debug("Debug: Files being sent to input field:\n" + files_to_send)
         file_input.send_keys(files_to_send)
-        try:
-            logfile.write(files_to_send)
-        except Exception as e:
-            logger.warning(f"Error writing log of files: {e}, continuing")
             
     except Exception as e:
         logger.warning(f"Error sending files to input: {e}, continuing")
-        save_debug_snapshot(driver, f"upload_input_error_batch_{batch_number}")
-        return False
+        save_debug_snapshot(driver, f"upload_input_error_batch_{batch_number}", error=True)
+        return None, None
         
         
     # Monitor upload progress
@@ -371,8 +2177,8 @@ def upload_batch(driver, batch, batch_number, batch_count, batch_end_count, logf
         wait.until(EC.presence_of_element_located((By.XPATH, upload_text_xpath)))
     except TimeoutException:
         logger.warning("⚠️ Upload progress text not found. Continuing")
-        save_debug_snapshot(driver, f"upload_progress_not_found_batch_{batch_number}")
-        return False
+        save_debug_snapshot(driver, f"upload_progress_not_found_batch_{batch_number}", error=True)
+        return 'no_progress', None
     
     logger.debug("Monitoring batch upload progress...")
     last_progress = 0
@@ -381,102 +2187,143 @@ def upload_batch(driver, batch, batch_number, batch_count, batch_end_count, logf
     max_upload_time = max(300, 2 * len(batch))  # maximum 2*batch_size seconds per batch
     start_time = time.time()
 
+    website_total = 0
+    end_state = 'done'
     while True:
-        # Check for absolute timeout
-        if time.time() - start_time > max_upload_time:
+        # Stall and maximum timeouts count from real progress events, not from polling ticks
+        now = time.time()
+        remaining_max = max_upload_time - (now - start_time)
+        remaining_stall = stall_timeout - (now - last_progress_change_time)
+        if remaining_max <= 0:
             logger.info(f"\nMaximum upload time ({max_upload_time}s) reached. Assuming complete.")
+            end_state = 'timeout'
             break
-            
-        time.sleep(2)
-        try:
-            upload_text_elem = driver.find_element(By.XPATH, upload_text_xpath)
-            text = upload_text_elem.text.strip()
-            
-            # Try to parse progress
-            current_progress = 0
-            try:
-                if " of " in text:
-                    parts = text.split(" of ")
-                    current_progress = int(parts[0])
-                    # Get the total from the text which may be different from our batch size
-                    website_total = int(parts[1].split(" ")[0])
-            except ValueError:
-                logger.warning("Progress bar {text} could not be parsed. Continuing")
-                pass  # Progress couldn't be parsed
-                
-            if current_progress > 0:
-                # Calculate the progress relative to this batch
-                total_for_batch = len(batch)
-                    
-                batch_start_count = (batch_number-1)*total_for_batch+1
-                batch_progress = current_progress - batch_start_count + 1
-                
-                # Make sure batch_progress doesn't go negative (shouldn't happen but just in case)
-                batch_progress = max(0, batch_progress)
-                # Dot-based progress bar for this batch
-                bar_width = 20
-                progress_ratio = min(batch_progress / total_for_batch, 1.0)
-                dots = int(progress_ratio * bar_width)
-                spaces = bar_width - dots
-                progress_bar = "." * dots + " " * spaces
-                
-                print(f"\rUploading: [{progress_bar}] {batch_progress}/{total_for_batch} (Total: {current_progress}/{website_total}) (Batch {batch_number} of {batch_count})", end="")
-                
-                # Check if progress changed
-                if current_progress != last_progress:
-                    last_progress = current_progress
-                    last_progress_change_time = time.time()
-                    
-                # If we reached the expected end count for this batch, exit
-                if current_progress >= batch_end_count:
-                    time.sleep(5)  # Give it 5 seconds after reaching target
-                    logger.debug(f"\nUpload reached target {batch_end_count} - batch complete")
-                    break
-            else:
-                print(f"\rUploading: Waiting for progress update... ('{text}')", end="")
-                
-            # Check for stalled progress
-            if time.time() - last_progress_change_time > stall_timeout:
-                logger.info(f"\nProgress stalled for {stall_timeout}s - assuming upload complete")
-                break
-                
-        except NoSuchElementException:
-            # Progress element has disappeared
-            logger.info("\nUpload complete - progress indicator disappeared. Continuing")
+        if remaining_stall <= 0:
+            logger.info(f"\nProgress stalled for {stall_timeout}s - assuming upload complete")
+            end_state = 'stalled'
             break
+
+        try:
+            driver.set_script_timeout(min(remaining_max, remaining_stall) + 30)
+            status = driver.execute_async_script(WATCH_UPLOAD_PROGRESS_JS, upload_text_xpath, last_progress,
+                                                 batch_end_count, int(remaining_stall * 1000), int(remaining_max * 1000))
         except Exception as e:
             logger.warning(f"\nWarning reading progress: {e}. Continuing")
             # Don't update the last_progress_change_time on errors
+            time.sleep(1)
+            continue
+
+        state = status['state']
+        current_progress = status['progress']
+        if state == 'closed':
+            # Progress element has disappeared
+            logger.info("\nUpload complete - progress indicator disappeared. Continuing")
+            end_state = state
+            break
+        if state == 'stalled':
+            logger.info(f"\nProgress stalled for {stall_timeout}s - assuming upload complete")
+            end_state = state
+            break
+        if state == 'timeout':
+            logger.info(f"\nMaximum upload time ({max_upload_time}s) reached. Assuming complete.")
+            end_state = state
+            break
+
+        if current_progress > 0:
+            # Get the total from the text which may be different from our batch size
+            website_total = status['total'] or website_total
+            # Calculate the progress relative to this batch
+            total_for_batch = len(batch)
+                
+            batch_start_count = batch_end_count - total_for_batch + 1
+            batch_progress = current_progress - batch_start_count + 1
+            
+            # Make sure batch_progress doesn't go negative (shouldn't happen but just in case)
+            batch_progress = max(0, batch_progress)
+            # Dot-based progress bar for this batch
+            bar_width = 20
+            progress_ratio = min(batch_progress / total_for_batch, 1.0)
+            dots = int(progress_ratio * bar_width)
+            spaces = bar_width - dots
+            progress_bar = "." * dots + " " * spaces
+            
+            print(f"\rUploading: [{progress_bar}] {batch_progress}/{total_for_batch} (Total: {current_progress}/{website_total}) (Batch {batch_number} of {batch_count})", end="")
+        else:
+            print(f"\rUploading: Waiting for progress update... ('{status['text']}')", end="")
+
+        if current_progress != last_progress:
+            last_progress = current_progress
+            last_progress_change_time = time.time()
+
+        # If we reached the expected end count for this batch, exit
+        if state == 'done':
+            logger.debug(f"\nUpload reached target {batch_end_count} - batch complete")
+            break
     
     print(f"\r")
     logger.debug(f"Batch {batch_number} upload complete.")
-    return True
+    return end_state, last_progress or None
+
 
+def upload_photos(driver, selected_images, batch_size, on_batch_done=None, file_sizes=None, batch_mb=None, max_retries=3,
+                  remote_url=None, remote_path_map=None):
+    """Upload photos to the current playlist in batches.
 
-def upload_photos(driver, selected_images, batch_size):
-    """Upload photos to the current playlist in batches."""
+    on_batch_done, if given, is called with the files of every batch that landed in the playlist.
+    With batch_mb, batches are built by an adaptive byte budget starting at batch_mb (see BatchScheduler)
+    and batch_size only caps the number of files per batch. Files that did not land are retried in later
+    batches, up to max_retries times. remote_url and remote_path_map are passed on to upload_batch().
+    """
     try:
         # logger.info("Preparing to upload photos max_file_size_mb=%d, max_photos=%d, batch_size=%d ..." % (max_file_size_mb, max_photos, batch_size))
         
         # Track cumulative uploads across all batches
         cumulative_uploaded_count = 0
+        # Names already in the playlist, which say nothing about whether a file of a batch landed
+        try:
+            shown_names = set(playlist_photo_names(driver))
+        except Exception as e:
+            logger.debug(f"Could not read playlist photo names: {e}")
+            shown_names = None
 
         # Write cumulative list to debug file
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         debug_file_name = f"{timestamp}_uploaded_files.txt"
+        if getattr(job_context, 'name', None):
+            debug_file_name = f"{timestamp}_{job_context.name}_uploaded_files.txt"
         logfile=None
         try:
-            # os.makedirs("debug", exist_ok=True)
+            os.makedirs("debug", exist_ok=True)
             debug_file_path = os.path.join("debug", debug_file_name)  # Use debug_screenshots directory
             logfile=open(debug_file_path, "w")
         except Exception as e:
             logger.warning(f"Error creating {debug_file_name}. Continuing")
            
        
-        for i in range(0, len(selected_images), batch_size):
-            batch = selected_images[i:i + batch_size]
-            batch_number = i // batch_size + 1
-            batch_count = ((len(selected_images) - 1) // batch_size + 1)
+        # The pause between batches only grows when the site pushes back (a batch failed) and decays after successes
+        inter_batch_delay = 0
+        sizes = dict(file_sizes or {})
+        sizes.update((path, os.path.getsize(path)) for path in selected_images if path not in sizes)
+        budget_bytes = int(batch_mb * 1024 * 1024) if batch_mb else None
+        scheduler = BatchScheduler(selected_images, sizes, batch_size, budget_bytes, max_retries=max_retries)
+        if budget_bytes:
+            logger.info(f"Batch plan: {len(selected_images)} photos, {scheduler.remaining_bytes() / 1024 / 1024:.1f} MB, "
+                        f"starting at {batch_mb} MB per batch (adapting between {scheduler.min_bytes / 1024 / 1024:.1f} "
+                        f"and {scheduler.max_bytes / 1024 / 1024:.1f} MB), at most {batch_size} photos per batch.")
+        while True:
+            batch = scheduler.next_batch()
+            if not batch:
+                retry_wait = scheduler.retry_wait()
+                if retry_wait is None:
+                    break
+                logger.info(f"Waiting {retry_wait:.0f}s before retrying {len(scheduler.pending())} photos...")
+                time.sleep(retry_wait)
+                continue
+            if inter_batch_delay:
+                logger.debug(f"Waiting {inter_batch_delay:.1f}s before the next batch...")
+                time.sleep(inter_batch_delay)
+            batch_number = scheduler.batches_done + 1
+            batch_count = scheduler.estimated_batch_count() + 1
 
             # Expected start and end counts for this batch
             batch_end_count = cumulative_uploaded_count + len(batch)
@@ -484,77 +2331,949 @@ def upload_photos(driver, selected_images, batch_size):
             
             # Upload the batch
             logger.debug(f"Uploading batch {batch_number} of {batch_count} ({len(batch)} photos)...")
-            batch_success = upload_batch(
+            batch_start_time = time.time()
+            batch_state, site_count = upload_batch(
                 driver, 
                 batch, 
                 batch_number, 
                 batch_count,
                 batch_end_count,
-                logfile
+                remote_url,
+                remote_path_map
             )
-            
-            if batch_success:
-                # Update the cumulative count for the next batch
-                cumulative_uploaded_count += len(batch)
 
+            # Reconcile with what the site reports so one bad batch does not throw off the counts of later ones
+            reloaded = False
+            if batch_state == 'done':
+                missing = []
+            elif batch_state is None:
+                missing = list(batch)
+            else:
+                landed_count = None if site_count is None else site_count - cumulative_uploaded_count
+                missing, reloaded = find_missing_files(driver, batch, landed_count, shown_names)
+            missing_set = set(missing)
+            landed = [path for path in batch if path not in missing_set]
+
+            rate = scheduler.record(batch, time.time() - batch_start_time, batch_state in ('done', 'closed') and not missing)
+            logger.info(f"Batch {batch_number}: {len(batch)} photos, {sum(sizes[path] for path in batch) / 1024 / 1024:.1f} MB "
+                        f"at {rate / 1024 / 1024:.2f} MB/s ({batch_state or 'not sent'})"
+                        + (f", next batch budget {scheduler.budget_bytes / 1024 / 1024:.1f} MB." if budget_bytes else "."))
+
+            # Update the cumulative count for the next batch; a reloaded page counts completed files from zero again
+            cumulative_uploaded_count = 0 if reloaded else cumulative_uploaded_count + len(landed)
+            # The log only lists files that made it into the playlist, not everything that was sent
+            if landed and logfile:
+                try:
+                    logfile.write("".join(os.path.abspath(path) + "\n" for path in landed))
+                    logfile.flush()
+                except Exception as e:
+                    logger.warning(f"Error writing log of files: {e}, continuing")
+            if shown_names is not None:
+                shown_names.update(os.path.basename(path) for path in landed)
+            if landed and on_batch_done:
+                on_batch_done(landed)
+            if missing:
+                logger.warning(f"{len(missing)} of {len(batch)} photos in batch {batch_number} did not land, queued for retry.")
+                metrics.event('photos_retried', len(missing))
+                scheduler.requeue(missing)
+                inter_batch_delay = min(max(inter_batch_delay * 2, 2), 60)
+            else:
+                inter_batch_delay = inter_batch_delay / 2 if inter_batch_delay >= 1 else 0
             
-            # Optional: wait briefly between batches
-            time.sleep(5)
-            
+        if scheduler.failed:
+            logger.warning(f"{len(scheduler.failed)} photos could not be uploaded after {max_retries} retries: "
+                           + ", ".join(os.path.basename(path) for path in scheduler.failed))
         logger.info("All batches uploaded.")
         
-        logger.info(f"List of all uploaded files written to {debug_file_path}")
+        if logfile:
+            logfile.close()
+            logger.info(f"List of all uploaded files written to {debug_file_path}")
         return True
         
     except Exception as e:
         logger.error(f"upload_photos() Exception: {e}")
-        save_debug_snapshot(driver, "upload_exception")
+        save_debug_snapshot(driver, "upload_exception", error=True)
         return False
         
-def main():
-    """Main function to orchestrate the Nixplay photo upload process."""
-    config = load_config()
-    username = config['username']
-    password = config['password']
-    playlist_name = config['playlist_name']
-    photos_directory = config['photos_directory']
-    max_photos = config['max_photos']
+def get_playlist_id(driver):
+    """Return the id of the playlist open in the browser (from its /playlist/<id> URL), or None."""
+    match = re.search(r'/playlist/(\d+)', driver.current_url)
+    return match.group(1) if match else None
+
+
+def http_session_from_driver(driver, pool_size):
+    """Create a pooled HTTP session that carries the logged-in browser's cookies."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    # Uploads are only retried when the server cannot have stored the photo: the connection failed or it asked
+    # to slow down (429). After a 5xx or a lost answer the photo may be stored already, so upload_photos_http
+    # reports the failure instead of sending the photo twice.
+    retry = Retry(total=3, connect=3, read=0, backoff_factor=1, status_forcelist=[429], allowed_methods=None)
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    for cookie in driver.get_cookies():
+        session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain', ''), path=cookie.get('path', '/'))
+        if cookie['name'] == 'csrftoken':
+            session.headers['X-CSRFToken'] = cookie['value']
+    session.headers['User-Agent'] = driver.execute_script("return navigator.userAgent;")
+    session.headers['Referer'] = driver.current_url
+    return session
+
+
+def mentions_name(payload, name):
+    """Check whether a decoded JSON response holds the string name anywhere."""
+    if isinstance(payload, dict):
+        return any(mentions_name(value, name) for value in payload.values())
+    if isinstance(payload, list):
+        return any(mentions_name(value, name) for value in payload)
+    return payload == name
+
+
+def upload_file_http(session, upload_url, path):
+    """POST one photo to the upload endpoint; returns None on success or an error message.
+
+    Only a JSON answer naming the file counts as success: a login or error page served with status 200
+    must not be taken for an upload.
+    """
+    try:
+        name = os.path.basename(path)
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        with open(path, 'rb') as f:
+            response = session.post(upload_url, files={'file': (name, f, content_type)}, timeout=(10, 300))
+        if not response.ok:
+            return f"HTTP {response.status_code}"
+        try:
+            payload = response.json()
+        except ValueError:
+            return f"HTTP {response.status_code} without a JSON answer ({response.headers.get('Content-Type', 'no content type')})"
+        if not mentions_name(payload, name):
+            return f"HTTP {response.status_code}, but the answer does not name the file"
+        return None
+    except Exception as e:
+        return str(e)
+
+
+@timed('http_upload', lambda failed, session, upload_url, selected_images, *args, **kwargs: {
+    'ok': not failed, 'files': len(selected_images) - len(failed)})
+def upload_photos_http(session, upload_url, selected_images, batch_size, workers, on_batch_done=None):
+    """Upload photos with concurrent HTTP requests, batch_size files at a time; returns the files that failed.
+
+    on_batch_done, if given, is called with the files of each batch that uploaded successfully.
+    """
+    failed = []
+    uploaded_bytes = 0
+    start_time = time.time()
+    batch_count = (len(selected_images) - 1) // batch_size + 1 if selected_images else 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i in range(0, len(selected_images), batch_size):
+            batch = selected_images[i:i + batch_size]
+            batch_number = i // batch_size + 1
+            done = []
+            for path, error in zip(batch, pool.map(lambda path: upload_file_http(session, upload_url, path), batch)):
+                if error:
+                    logger.warning(f"HTTP upload of '{os.path.basename(path)}' failed: {error}")
+                    failed.append(path)
+                else:
+                    done.append(path)
+                    uploaded_bytes += os.path.getsize(path)
+            logger.debug(f"HTTP batch {batch_number} of {batch_count}: {len(done)} of {len(batch)} photos uploaded.")
+            if done and on_batch_done:
+                on_batch_done(done)
+
+    elapsed = max(time.time() - start_time, 1e-6)
+    logger.info(f"Uploaded {len(selected_images) - len(failed)} photos over HTTP in {elapsed:.1f}s "
+                f"({uploaded_bytes / elapsed / 1024 / 1024:.2f} MB/s), {len(failed)} failed.")
+    return failed
+
+
+def load_job(config, config_dir):
+    """Resolve the settings of one playlist sync from the config, with file locations relative to config_dir."""
     base_url = config['base_url'].rstrip('/')
     max_file_size_mb = config['max_file_size_mb']
-    batch_size = config['batch_size']
+    # Set catalog_file or chromedriver_cache to "" to disable them
+    catalog_file = config.get('catalog_file', 'catalog.db')
+    chromedriver_cache = config.get('chromedriver_cache', 'chromedriver.json')
+    chrome_profile_dir = config.get('chrome_profile_dir')
+    # With a remote browser, the Chrome profile lives on the browser's machine
+    selenium_remote_url = config.get('selenium_remote_url')
+    if chrome_profile_dir and not selenium_remote_url:
+        chrome_profile_dir = os.path.join(config_dir, chrome_profile_dir)
+
+    # "dedupe": true skips identical copies, "perceptual" also resized or re-encoded ones
+    dedupe = config.get('dedupe')
+    if dedupe is True:
+        dedupe = 'content'
+    if dedupe and not catalog_file:
+        logger.warning("Deduplication needs the photo catalog (catalog_file); selecting without it.")
+        dedupe = None
+    if dedupe == 'perceptual' and importlib.util.find_spec('PIL') is None:
+        logger.warning("Perceptual deduplication needs Pillow (pip install Pillow); only skipping identical copies.")
+        dedupe = 'content'
+
+    # Which photos to prefer, read from the metadata index in the catalog
+    policy_name = config.get('selection_policy', 'random')
+    prefer_orientation = config.get('prefer_orientation')
+    if policy_name not in ('random', 'on_this_day', 'recent', 'balanced_folders'):
+        logger.error(f"Unknown selection_policy '{policy_name}'; use random, on_this_day, recent or balanced_folders.")
+        exit(1)
+    if prefer_orientation not in (None, 'landscape', 'portrait'):
+        logger.error(f"Unknown prefer_orientation '{prefer_orientation}'; use landscape or portrait.")
+        exit(1)
+    selection_policy = None
+    if policy_name != 'random' or prefer_orientation:
+        selection_policy = {
+            'name': policy_name,
+            'recent_months': config.get('recent_months', 12),
+            'on_this_day_days': config.get('on_this_day_days', 3),
+            'prefer_orientation': prefer_orientation,
+        }
+    if selection_policy and not catalog_file:
+        logger.warning("selection_policy and prefer_orientation need the photo catalog (catalog_file); selecting at random.")
+        selection_policy = None
+
+    if config.get('transport') == 'http' and not config.get('http_upload_url'):
+        logger.error("The http transport needs the upload endpoint in http_upload_url; it is not known for nixplay.com (see README).")
+        exit(1)
+
+    preprocess_settings = None
+    if config.get('preprocess'):
+        if importlib.util.find_spec('PIL') is None:
+            logger.warning("Preprocessing needs Pillow (pip install Pillow); uploading original files instead.")
+        else:
+            preprocess_settings = {
+                'max_width': config.get('preprocess_max_width', 1280),
+                'max_height': config.get('preprocess_max_height', 800),
+                'quality': config.get('preprocess_quality', 85),
+                'cache_dir': os.path.join(config_dir, config.get('preprocess_cache_dir', 'cache')),
+            }
+
+    return {
+        'name': config.get('name'),
+        'username': config['username'],
+        'password': config['password'],
+        'playlist_name': config['playlist_name'],
+        'photos_directory': config['photos_directory'],
+        'max_photos': config['max_photos'],
+        'base_url': base_url,
+        'max_file_size_mb': max_file_size_mb,
+        # Large originals are fine when they get downsized before upload
+        'selection_max_file_size_mb': config.get('preprocess_max_source_mb', 200) if preprocess_settings else max_file_size_mb,
+        'batch_size': config['batch_size'],
+        'batch_mb': config.get('batch_mb'),
+        'max_retries': config.get('max_retries', 3),
+        'delete_chunk_size': config.get('delete_chunk_size', 500),
+        'delete_timeout': config.get('delete_timeout_minutes', 10) * 60,
+        'catalog_path': os.path.join(config_dir, catalog_file) if catalog_file else None,
+        'seed': config.get('random_seed'),
+        'scan_workers': config.get('scan_workers', 8),
+        'dedupe': dedupe,
+        'hash_workers': config.get('hash_workers', 4),
+        'dedupe_distance': config.get('dedupe_distance', 4),
+        'selection_policy': selection_policy,
+        'metadata_workers': config.get('metadata_workers', 4),
+        'sync_mode': config.get('sync_mode', 'full'),
+        'rotate_fraction': config.get('rotate_fraction', 1.0),
+        'manifest_path': os.path.join(config_dir, config.get('manifest_file', 'manifest.json')),
+        'journal_path': os.path.join(config_dir, config.get('journal_file', 'journal.jsonl')),
+        'playlist_key': manifest_key(base_url, config['username'], config['playlist_name']),
+        'preprocess_settings': preprocess_settings,
+        'preprocess_workers': config.get('preprocess_workers'),
+        'driver_cache_path': os.path.join(config_dir, chromedriver_cache) if chromedriver_cache else None,
+        'chrome_profile_dir': chrome_profile_dir or None,
+        'browser_memory_mb': config.get('browser_memory_mb'),
+        'lean_browser': config.get('lean_browser', False),
+        'lean_block_urls': config.get('lean_block_urls', []),
+        'selenium_remote_url': selenium_remote_url,
+        'remote_path_map': config.get('remote_path_map', {}),
+        'transport': config.get('transport', 'selenium'),
+        'http_upload_workers': config.get('http_upload_workers', 4),
+        'http_upload_url': config.get('http_upload_url'),
+    }
+
+
+def select_photos(job, resume=False, rebuild_catalog=False, refresh_catalog=True):
+    """Choose the photos of this run, or reload the unfinished part of an interrupted run when resuming.
+
+    Returns the run state: the selection ('image_files'), the manifest and the photos it lists for this
+    playlist, the resumed journal (or None) with its remaining 'files_to_upload', and the scanned file sizes.
+    """
+    manifest = load_manifest(job['manifest_path'])
+    playlist_photos = manifest.get(job['playlist_key'], {}).get('photos', {})
+    file_sizes = {}
+    files_to_upload = None
+
+    journal = None
+    if resume:
+        journal = read_journal(job['journal_path'])
+        if journal is None or journal['done'] or journal['playlist'] != job['playlist_key']:
+            logger.warning("No interrupted run of this playlist to resume, starting a new run.")
+            journal = None
+
+    if journal:
+        completed = set(journal['completed'])
+        image_files = journal['selection']
+        files_to_upload = [path for path in journal['files'] if path not in completed]
+        logger.info(f"Resuming interrupted run: {len(completed)} of {len(journal['files'])} photos already uploaded, "
+                    f"{len(files_to_upload)} to go.")
+    else:
+        keep = None
+        rotated_out = None
+        seed = job['seed']
+        if job['sync_mode'] == 'diff' and playlist_photos:
+            # Keep photos already on the frame, except a random rotate_fraction of them that make room for new ones
+            current = sorted(playlist_photos)
+            if seed is not None:
+                # A fixed seed would pick the same photos every run; mixing in what is on the frame keeps the
+                # rotation repeatable for a given playlist while still moving on at every rotation
+                frame = hashlib.blake2b('\0'.join(current).encode('utf-8', 'surrogateescape'), digest_size=8).hexdigest()
+                seed = f"{seed}:{frame}"
+            keep_count = len(current) - round(len(current) * job['rotate_fraction'])
+            keep = random.Random(seed).sample(current, keep_count)
+            rotated_out = set(current) - set(keep)
+
+        image_files = get_image_files(job['photos_directory'], job['selection_max_file_size_mb'], job['max_photos'], job['catalog_path'],
+                                      rebuild_catalog, seed, job['scan_workers'], keep, file_sizes, refresh_catalog,
+                                      job['dedupe'], job['hash_workers'], job['dedupe_distance'], job['selection_policy'],
+                                      job['metadata_workers'], rotated_out)
+        if image_files:
+            logger.info(f"Found {len(image_files)} image files.")
+
+    return {
+        'manifest': manifest,
+        'playlist_photos': playlist_photos,
+        'journal': journal,
+        'image_files': image_files,
+        'files_to_upload': files_to_upload,
+        'file_sizes': file_sizes,
+        'upload_paths': {},
+        'preparing': None,
+    }
+
+
+def prepare_uploads(job, run, paths=None):
+    """Map source files to the files actually uploaded, preprocessing the ones not prepared yet.
+
+    Without paths, prepares the photos this run will most likely upload, so that work is done before the browser starts.
+    """
+    if paths is None:
+        if run['journal']:
+            paths = run['files_to_upload']
+        else:
+            paths = [path for path in run['image_files'] if path not in run['playlist_photos'] or job['sync_mode'] != 'diff']
+    if not job['preprocess_settings']:
+        return list(paths)
+    upload_paths = run['upload_paths']
+    todo = [path for path in paths if path not in upload_paths]
+    if todo:
+        upload_paths.update(preprocess_images(todo, job['max_file_size_mb'], job['preprocess_settings'], job['preprocess_workers']))
+    return [upload_paths[path] for path in paths if path in upload_paths]
+
+
+def start_preparing(job, run):
+    """Run prepare_uploads(job, run) on a background thread.
+
+    Preprocessing then overlaps with starting the browser, logging in and clearing the playlist;
+    sync_playlist() waits for it before uploading.
+    """
+    name = getattr(job_context, 'name', None)
+
+    def prepare():
+        job_context.name = name
+        return prepare_uploads(job, run)
+
+    pool = ThreadPoolExecutor(max_workers=1)
+    run['preparing'] = pool.submit(prepare)
+    pool.shutdown(wait=False)
+
+
+def choose_diff_sync(job, run):
+    """Return (names_to_delete, files_to_upload) when the run can update the playlist in place, or None for a full sync."""
+    if job['sync_mode'] != 'diff':
+        return None
+    if not run['playlist_photos']:
+        logger.info("No manifest for this playlist yet, doing a full sync.")
+        return None
+    sync_plan = plan_sync(run['playlist_photos'], run['image_files'])
+    if sync_plan is None:
+        logger.info("File names to delete clash with photos that stay, doing a full sync.")
+    return sync_plan
+
+
+def ensure_logged_in(driver, job, check_session=False):
+    """Log in, unless check_session is set and the browser is still logged in (persistent profile or warm session)."""
+    if check_session and has_valid_session(driver, job['base_url']):
+        logger.info("Reusing the logged-in browser session.")
+        return True
+    return login_to_nixplay(driver, job['base_url'], job['username'], job['password'])
+
+
+def sync_playlist(driver, job, run, run_start_time=None, phase_times=None):
+    """Bring the playlist in line with the run's selection in a logged-in browser; returns True on success.
+
+    Opens the playlist, deletes what has to go (everything, or only the changes in diff mode), and uploads
+    the rest, recording finished batches in the journal and manifest. With phase_times, the time from
+    run_start_time to the first upload is logged.
+    """
+    manifest = run['manifest']
+    manifest_path = job['manifest_path']
+    playlist_key = job['playlist_key']
+    playlist_photos = run['playlist_photos']
+    image_files = run['image_files']
+    files_to_upload = run['files_to_upload']
+    upload_paths = run['upload_paths']
+    journal_path = job['journal_path']
+    base_url = job['base_url']
+    batch_size = job['batch_size']
+
+    phase_start_time = time.time()
+    if not find_playlist(driver, base_url, job['playlist_name']):
+        logger.error(f"Could not find playlist '{job['playlist_name']}'.")
+        return False
+    logger.info(("Lean browser: " if job['lean_browser'] else "Browser: ") + describe_footprint(browser_footprint(driver)) + ".")
     
-    image_files = get_image_files(photos_directory, max_file_size_mb, max_photos)
+    if run['journal']:
+        # The playlist was already cleared by the interrupted run; only its unfinished batches are left
+        uploaded_photos = manifest.get(playlist_key, {}).get('photos', {})
+        journal_log = open_journal(journal_path)
+    else:
+        sync_plan = choose_diff_sync(job, run)
+        if sync_plan is not None:
+            names_to_delete, files_to_upload = sync_plan
+            logger.info(f"Differential sync: {len(names_to_delete)} photos to delete, {len(files_to_upload)} to upload, "
+                        f"{len(image_files) - len(files_to_upload)} unchanged.")
+            selected = set(image_files)
+            uploaded_photos = {path: name for path, name in playlist_photos.items() if path in selected}
+            if names_to_delete and not delete_photos(driver, names_to_delete, chunk_size=job['delete_chunk_size'],
+                                                     delete_timeout=job['delete_timeout']):
+                logger.error("Failed to delete changed photos, falling back to a full sync.")
+                sync_plan = None
+            else:
+                # Removed photos are gone; the rest of the manifest is kept until the uploads land
+                manifest[playlist_key] = {'photos': uploaded_photos}
+                save_manifest(manifest_path, manifest)
+
+        if sync_plan is None:
+            files_to_upload = image_files
+            uploaded_photos = {}
+            if delete_all_photos(driver, chunk_size=job['delete_chunk_size'], delete_timeout=job['delete_timeout']):
+                manifest[playlist_key] = {'photos': uploaded_photos}
+            else:
+                logger.error("Failed to delete existing photos. Continuing with upload...")
+                # What is left in the playlist is unknown, so the next diff sync must start over
+                manifest.pop(playlist_key, None)
+            save_manifest(manifest_path, manifest)
+
+        journal_log = open_journal(journal_path, {'playlist': playlist_key, 'selection': image_files, 'files': files_to_upload})
+
+    if run['preparing'] is not None:
+        # Preprocessing started before the browser; whatever is still running has overlapped with the delete
+        run['preparing'].result()
+        run['preparing'] = None
+    upload_files = prepare_uploads(job, run, files_to_upload)
+    source_of = {upload_paths.get(path, path): path for path in files_to_upload}
+
+    def record_batch(batch):
+        append_journal(journal_log, {'event': 'batch', 'files': [source_of[path] for path in batch]})
+        if playlist_key in manifest:
+            uploaded_photos.update((source_of[path], os.path.basename(path)) for path in batch)
+            save_manifest(manifest_path, manifest)
+    
+    if phase_times is not None:
+        phase_times['playlist and delete'] = time.time() - phase_start_time
+        logger.info(f"Cold start to first upload: {time.time() - run_start_time:.1f}s ("
+                    + ", ".join(f"{phase} {seconds:.1f}s" for phase, seconds in phase_times.items()) + ").")
+
+    with journal_log:
+        use_browser = True
+        if job['transport'] == 'http':
+            playlist_id = get_playlist_id(driver)
+            if playlist_id is None:
+                logger.warning(f"Could not read the playlist id from '{driver.current_url}', uploading through the browser.")
+            else:
+                session = http_session_from_driver(driver, job['http_upload_workers'])
+                upload_url = job['http_upload_url'].format(base_url=base_url, playlist_id=playlist_id)
+                upload_files = upload_photos_http(session, upload_url, upload_files, batch_size, job['http_upload_workers'], record_batch)
+                use_browser = bool(upload_files)
+                if upload_files:
+                    logger.warning(f"Retrying {len(upload_files)} failed photos through the browser.")
+                    driver.refresh()
+        if use_browser and not upload_photos(driver, upload_files, batch_size, record_batch, run['file_sizes'], job['batch_mb'], job['max_retries'],
+                                             job['selenium_remote_url'], job['remote_path_map']):
+            logger.error("Failed to upload photos.")
+            return False
+        append_journal(journal_log, {'event': 'done'})
+    return True
+
+
+def driver_is_alive(driver):
+    """Check that the browser and its WebDriver session still respond."""
+    try:
+        driver.execute_script("return 1;")
+        return True
+    except Exception:
+        return False
+
+
+def quit_driver(driver):
+    """Quit the browser, ignoring errors from a driver that is already gone."""
+    try:
+        driver.quit()
+    except Exception as e:
+        logger.debug(f"Error quitting WebDriver: {e}")
+
+
+def watch_photos_directory(directory):
+    """Watch the photos directory for changes (inotify on Linux, via the optional watchdog package).
+
+    Returns a threading.Event that is set whenever something under directory changes (and initially),
+    or None when watchdog is not installed.
+    """
+    try:
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+    except ImportError:
+        logger.info("watchdog is not installed (pip install watchdog); the photo catalog is refreshed at every rotation.")
+        return None
+
+    changed = threading.Event()
+    changed.set()
+
+    class ChangeHandler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            if event.event_type not in ('opened', 'closed', 'closed_no_write'):
+                changed.set()
+
+    observer = Observer()
+    observer.daemon = True
+    observer.schedule(ChangeHandler(), directory, recursive=True)
+    observer.start()
+    logger.info(f"Watching '{directory}' for changes.")
+    return changed
+
+
+def run_daemon(job, interval, resume=False, retry_interval=600):
+    """Keep one logged-in browser alive and sync the playlist every interval seconds until interrupted.
+
+    The photo catalog is only refreshed when the directory watcher saw changes. A dead driver or an expired
+    session is detected at the start of each rotation and replaced; a failed rotation is retried after
+    retry_interval seconds (or interval, if shorter).
+    """
+    changed = watch_photos_directory(job['photos_directory'])
+    driver = None
+    logged_in = False
+    try:
+        while True:
+            rotation_start_time = time.time()
+            metrics.start()
+            succeeded = False
+            try:
+                refresh_catalog = changed is None or changed.is_set()
+                # Cleared before the scan, so changes made while it runs are not lost
+                if changed is not None:
+                    changed.clear()
+                try:
+                    run = select_photos(job, resume, refresh_catalog=refresh_catalog)
+                except BaseException:
+                    # The catalog update was rolled back, so the next rotation has to scan the changes again
+                    if refresh_catalog and changed is not None:
+                        changed.set()
+                    raise
+                resume = False
+                if not run['image_files']:
+                    raise RuntimeError(f"No image files found in '{job['photos_directory']}'.")
+                start_preparing(job, run)
+
+                if driver is not None and not driver_is_alive(driver):
+                    logger.warning("Browser session died, starting a new one.")
+                    quit_driver(driver)
+                    driver = None
+                if driver is None:
+                    driver = setup_webdriver(job['driver_cache_path'], job['chrome_profile_dir'], job['browser_memory_mb'],
+                                             job['lean_browser'], job['lean_block_urls'], job['selenium_remote_url'])
+                    logged_in = False
+                if not ensure_logged_in(driver, job, check_session=logged_in or bool(job['chrome_profile_dir'])):
+                    raise RuntimeError("Login failed.")
+                logged_in = True
+
+                succeeded = sync_playlist(driver, job, run)
+            except SystemExit:
+                # Fatal errors in a single rotation (scan or browser start) must not end the daemon
+                logger.error("Rotation aborted.")
+            except Exception as e:
+                logger.error(f"run_daemon() Exception: {str(e)}")
+                if driver is not None:
+                    save_debug_snapshot(driver, "daemon_rotation_error", error=True)
+            snapshots.flush()
+            metrics.write(succeeded)
+            if driver is not None and driver.session_id in copied_to_sessions:
+                # A warm session would pile up every rotation's copies on the browser's machine
+                logger.info("Ending the remote browser session to remove the photos copied to it (set remote_path_map to avoid this).")
+                copied_to_sessions.discard(driver.session_id)
+                quit_driver(driver)
+                driver = None
+
+            delay = interval if succeeded else min(interval, retry_interval)
+            delay = max(0, delay - (time.time() - rotation_start_time))
+            logger.info(("Rotation completed." if succeeded else "Rotation failed.") + f" Next rotation in {delay / 60:.0f} minutes.")
+            time.sleep(delay)
+    except KeyboardInterrupt:
+        logger.info("Stopping.")
+    finally:
+        if driver is not None:
+            quit_driver(driver)
+        snapshots.flush()
+
+
+def run_job(job, resume=False, refresh_catalog=False, log_dir=None):
+    """Run one sync in its own browser for run_jobs(); returns a summary dict and never raises.
+
+    With log_dir, everything logged for the job also goes to <log_dir>/<name>.log.
+    """
+    job_context.name = job['name']
+    log_handler = None
+    if log_dir:
+        try:
+            os.makedirs(log_dir, exist_ok=True)
+            log_handler = logging.FileHandler(os.path.join(log_dir, f"{job['name']}.log"))
+            log_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+            log_handler.addFilter(JobLogFilter(job['name']))
+            logger.addHandler(log_handler)
+        except OSError as e:
+            logger.warning(f"Could not open a log file for job '{job['name']}': {e}")
+
+    job_start_time = time.time()
+    result = {'name': job['name'], 'ok': False, 'photos': 0, 'error': None}
+    driver = None
+    try:
+        run = select_photos(job, resume, refresh_catalog=refresh_catalog)
+        if not run['image_files']:
+            raise RuntimeError(f"No image files found in '{job['photos_directory']}'.")
+        result['photos'] = len(run['image_files'])
+        start_preparing(job, run)
+        driver = setup_webdriver(job['driver_cache_path'], job['chrome_profile_dir'], job['browser_memory_mb'],
+                                 job['lean_browser'], job['lean_block_urls'], job['selenium_remote_url'])
+        if not ensure_logged_in(driver, job, check_session=bool(job['chrome_profile_dir'])):
+            raise RuntimeError("Login failed.")
+        result['ok'] = sync_playlist(driver, job, run)
+        if not result['ok']:
+            result['error'] = "sync failed"
+    except SystemExit:
+        # The step that gave up has logged why
+        result['error'] = "aborted"
+    except Exception as e:
+        logger.error(f"run_job() Exception: {str(e)}")
+        result['error'] = str(e)
+        if driver is not None:
+            save_debug_snapshot(driver, "job_error", error=True)
+    finally:
+        if driver is not None:
+            quit_driver(driver)
+        result['seconds'] = time.time() - job_start_time
+        logger.info(f"Job {'completed' if result['ok'] else 'failed'} in {result['seconds']:.0f}s.")
+        if log_handler is not None:
+            logger.removeHandler(log_handler)
+            log_handler.close()
+        job_context.name = None
+    return result
+
+
+def scan_libraries(jobs, rebuild_catalog=False):
+    """Update the catalog of every photos_directory read by jobs, once per directory however many jobs share it.
+
+    Photos are hashed too when a job dedupes, and indexed when a job has a selection policy, so the jobs only
+    read the hashes and metadata instead of racing to compute them. Returns the (catalog_path, directory) pairs whose scan failed.
+    """
+    scans = {}
+    for job in jobs:
+        if job['catalog_path']:
+            scans.setdefault((job['catalog_path'], os.path.abspath(job['photos_directory'])), []).append(job)
+    failed_scans = set()
+    for (catalog_path, directory), scan_jobs in scans.items():
+        try:
+            conn = open_catalog(catalog_path)
+            try:
+                update_catalog(conn, directory, rebuild_catalog, max(job['scan_workers'] for job in scan_jobs))
+                dedupe_modes = {job['dedupe'] for job in scan_jobs if job['dedupe']}
+                if dedupe_modes:
+                    update_hashes(conn, directory, max(job['hash_workers'] for job in scan_jobs), 'perceptual' in dedupe_modes)
+                policy_jobs = [job for job in scan_jobs if job['selection_policy']]
+                if policy_jobs:
+                    update_metadata(conn, directory, max(job['metadata_workers'] for job in policy_jobs))
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"Scanning '{directory}' failed: {e}")
+            failed_scans.add((catalog_path, directory))
+    return failed_scans
+
+
+def scan_photos(jobs, rebuild_catalog=False):
+    """Bring the photo catalogs up to date and log what each job's photos_directory holds; returns True if every scan worked."""
+    failed_scans = scan_libraries(jobs, rebuild_catalog)
+    for job in jobs:
+        directory = os.path.abspath(job['photos_directory'])
+        max_size = job['selection_max_file_size_mb'] * 1024 * 1024
+        if (job['catalog_path'], directory) in failed_scans:
+            continue
+        distinct = None
+        if job['catalog_path']:
+            low, high = catalog_range(directory)
+            conn = open_catalog(job['catalog_path'])
+            try:
+                count, total, usable = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(size <= ?), 0) FROM files "
+                                                    "WHERE path >= ? AND path < ?", (max_size, low, high)).fetchone()
+                if job['dedupe']:
+                    distinct = conn.execute("SELECT COUNT(DISTINCT hashes.digest) FROM files JOIN hashes ON hashes.path = files.path "
+                                            "WHERE files.path >= ? AND files.path < ?", (low, high)).fetchone()[0]
+            finally:
+                conn.close()
+        else:
+            try:
+                sizes = [size for _, size in iter_image_files(directory, job['scan_workers'])]
+            except OSError as e:
+                logger.error(f"Scanning '{directory}' failed: {e}")
+                failed_scans.add((None, directory))
+                continue
+            count, total, usable = len(sizes), sum(sizes), sum(1 for size in sizes if size <= max_size)
+        logger.info(f"{job['name'] or job['playlist_name']}: {count} photos ({total / 1024 / 1024:.1f} MB) in '{directory}', "
+                    f"{usable} of them up to {job['selection_max_file_size_mb']} MB"
+                    + (f", {distinct} distinct" if distinct is not None else "") + ".")
+    return not failed_scans
+
+
+def plan_job(job, resume=False, rebuild_catalog=False):
+    """Show what a sync of this job would do, without a browser; returns False if there is nothing to upload.
+
+    The selection is printed to stdout, one path per line. What would be deleted, the upload batches and
+    their sizes are logged. With batch_mb the batches adapt to the upload speed once uploading, so the
+    logged batches are the ones at the starting budget.
+    """
+    run = select_photos(job, resume, rebuild_catalog)
+    image_files = run['image_files']
     if not image_files:
-        logger.error(f"No image files found in '{photos_directory}'.")
+        logger.error(f"No image files found in '{job['photos_directory']}'.")
+        return False
+    for path in image_files:
+        print(path)
+
+    sizes = run['file_sizes']
+    for path in image_files:
+        if path not in sizes:
+            try:
+                sizes[path] = os.path.getsize(path)
+            except OSError as e:
+                logger.warning(f"Cannot read '{path}': {e}")
+                sizes[path] = 0
+
+    def megabytes(paths):
+        return sum(sizes[path] for path in paths) / 1024 / 1024
+
+    logger.info(f"Selection for playlist '{job['playlist_name']}': {len(image_files)} photos, {megabytes(image_files):.1f} MB.")
+
+    if run['journal']:
+        files_to_upload = run['files_to_upload']
+        logger.info(f"Resuming the interrupted run: nothing is deleted, {len(files_to_upload)} photos are left to upload.")
+    else:
+        sync_plan = choose_diff_sync(job, run)
+        if sync_plan is None:
+            files_to_upload = image_files
+            logger.info("Full sync: every photo in the playlist is deleted, then the selection is uploaded.")
+        else:
+            names_to_delete, files_to_upload = sync_plan
+            logger.info(f"Differential sync: {len(names_to_delete)} photos to delete, {len(files_to_upload)} to upload, "
+                        f"{len(image_files) - len(files_to_upload)} unchanged.")
+
+    budget_bytes = int(job['batch_mb'] * 1024 * 1024) if job['batch_mb'] and job['transport'] != 'http' else None
+    scheduler = BatchScheduler(files_to_upload, sizes, job['batch_size'], budget_bytes)
+    batches = []
+    while True:
+        batch = scheduler.next_batch()
+        if not batch:
+            break
+        batches.append(batch)
+    logger.info(f"Upload over {job['transport']}: {len(files_to_upload)} photos, {megabytes(files_to_upload):.1f} MB in {len(batches)} batches"
+                + (" (before preprocessing)" if job['preprocess_settings'] else "") + ".")
+    for number, batch in enumerate(batches, 1):
+        logger.info(f"  Batch {number}: {len(batch)} photos, {megabytes(batch):.1f} MB")
+    return True
+
+
+def run_jobs(jobs, workers=2, resume=False, rebuild_catalog=False, log_dir=None):
+    """Run several syncs in parallel, each in its own headless Chrome, with at most workers browsers at a time.
+
+    Jobs reading the same photos_directory through the same catalog share one scan, done before any job
+    starts. Logs a summary of all jobs and returns True if every job succeeded.
+    """
+    run_start_time = time.time()
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - [%(job)s] %(message)s'))
+
+    # Resolve chromedriver once up front so the jobs do not race to fill its cache
+    for cache_path in {job['driver_cache_path'] for job in jobs if job['driver_cache_path'] and not job['selenium_remote_url']}:
+        try:
+            resolve_chromedriver(cache_path)
+        except Exception as e:
+            logger.warning(f"Could not resolve chromedriver: {e}")
+
+    failed_scans = scan_libraries(jobs, rebuild_catalog)
+
+    def needs_scan(job):
+        # Jobs without a catalog scan on their own; jobs whose shared scan failed try again themselves
+        return not job['catalog_path'] or (job['catalog_path'], os.path.abspath(job['photos_directory'])) in failed_scans
+
+    logger.info(f"Running {len(jobs)} jobs on up to {workers} browsers.")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_job, job, resume, needs_scan(job), log_dir) for job in jobs]
+        results = [future.result() for future in futures]
+
+    for result in results:
+        status = "ok" if result['ok'] else f"FAILED ({result['error']})"
+        logger.info(f"{result['name']}: {status}, {result['photos']} photos, {result['seconds']:.0f}s")
+    succeeded = sum(1 for result in results if result['ok'])
+    logger.info(f"{succeeded} of {len(results)} jobs succeeded in {time.time() - run_start_time:.0f}s.")
+    metrics.write(succeeded == len(results))
+    return succeeded == len(results)
+
+
+def main():
+    """Main function to orchestrate the Nixplay photo upload process."""
+    run_start_time = time.time()
+    parser = argparse.ArgumentParser(description="Upload photos from a directory to a Nixplay playlist.")
+    commands = parser.add_subparsers(dest="command", metavar="{scan,plan,sync,bench}", help="what to do (default: sync)")
+    config_args = argparse.ArgumentParser(add_help=False)
+    config_args.add_argument("--config", default="config.json", help="path to the config file (default: config.json)")
+    config_args.add_argument("--rebuild-catalog", action="store_true", help="discard the photo catalog and rescan the whole photos_directory")
+    selection_args = argparse.ArgumentParser(add_help=False)
+    selection_args.add_argument("--seed", help="random seed for a reproducible photo selection (overrides random_seed in the config)")
+    selection_args.add_argument("--sync", choices=["full", "diff"], help="full: delete all photos and upload the selection; diff: only delete and upload what changed (overrides sync_mode in the config)")
+    selection_args.add_argument("--resume", action="store_true", help="continue an interrupted run from its journal instead of starting over")
+    commands.add_parser("scan", parents=[config_args], help="update the photo catalog and show what the photos directories hold (no browser needed)")
+    commands.add_parser("plan", parents=[config_args, selection_args], help="print the selection and show the deletes, batches and bytes of a sync, without syncing (no browser needed)")
+    sync = commands.add_parser("sync", parents=[config_args, selection_args], help="update the playlist")
+    sync.add_argument("--daemon", action="store_true", help="keep running and sync the playlist every rotation_interval_minutes")
+    sync.add_argument("--jobs", type=int, help="number of jobs from the \"jobs\" list to run at the same time (overrides parallel_jobs in the config)")
+    bench = commands.add_parser("bench", help="time uploads against a local fake Nixplay instead of syncing (no config needed)")
+    bench.add_argument("--bench", action="store_true", help=argparse.SUPPRESS)
+    bench.add_argument("--bench-batch-sizes", default="10,25,50", help="comma-separated batch sizes to try (default: 10,25,50)")
+    bench.add_argument("--bench-library-sizes", default="100", help="comma-separated numbers of photos to upload (default: 100)")
+    bench.add_argument("--bench-photo-kb", type=int, default=500, help="size of each generated photo in KB (default: 500)")
+    bench.add_argument("--bench-bandwidth-mbps", type=float, help="simulated upload bandwidth in Mbit/s (default: unlimited)")
+    bench.add_argument("--bench-latency-ms", type=float, default=0, help="simulated latency of every request in ms (default: 0)")
+    bench.add_argument("--bench-failure-rate", type=float, default=0, help="share of uploads the fake server rejects (default: 0)")
+    bench.add_argument("--bench-delete-rate", type=float, help="photos per second the fake server deletes, in the background (default: at once)")
+    bench.add_argument("--bench-transport", choices=["selenium", "http"], default="selenium", help="upload transport to benchmark (default: selenium)")
+    bench.add_argument("--bench-browser", choices=["normal", "lean", "both"], default="normal", help="browser mode to benchmark; both compares them (default: normal)")
+    bench.add_argument("--bench-remote-url", help="benchmark the Chrome behind this Selenium server or Grid instead of a local one")
+    bench.add_argument("--bench-output", help="write the results as JSON to this file")
+    argv = sys.argv[1:]
+    if not argv or (argv[0] not in commands.choices and argv[0] not in ("-h", "--help")):
+        # Without a command, as in earlier versions: "--bench ..." runs the benchmark, anything else syncs
+        argv = ["bench" if "--bench" in argv else "sync"] + argv
+    args = parser.parse_args(argv)
+
+    if args.command == "bench":
+        # The stand-in server and the benchmark ship as separate files, only loaded for this command
+        try:
+            import nix_upload_bench
+        except ImportError as e:
+            logger.error(f"The benchmark needs {e.name}.py next to nix-upload.py.")
+            exit(1)
+        results = nix_upload_bench.run_benchmark(sys.modules[__name__], [int(size) for size in args.bench_batch_sizes.split(',')],
+                                                 [int(size) for size in args.bench_library_sizes.split(',')],
+                                                 args.bench_photo_kb, args.bench_bandwidth_mbps, args.bench_latency_ms / 1000,
+                                                 args.bench_failure_rate, args.bench_transport, args.bench_output,
+                                                 ['normal', 'lean'] if args.bench_browser == 'both' else [args.bench_browser], args.bench_delete_rate,
+                                                 args.bench_remote_url)
+        if any(result['duplicates'] for result in results):
+            exit(1)
+        return
+
+    config = load_config(args.config)
+    # Catalog, manifest, journal and caches live next to the config file unless absolute paths are given
+    config_dir = os.path.dirname(os.path.abspath(args.config))
+    jobs = [load_job(job_config, config_dir) for job_config in job_configs(config)]
+    if args.command == "scan":
+        if not scan_photos(jobs, args.rebuild_catalog):
+            exit(1)
+        return
+    for job in jobs:
+        if args.seed is not None:
+            job['seed'] = args.seed
+        if args.sync:
+            job['sync_mode'] = args.sync
+    if args.command == "plan":
+        if args.rebuild_catalog:
+            scan_libraries(jobs, rebuild_catalog=True)
+        planned = [plan_job(job, args.resume) for job in jobs]
+        if not all(planned):
+            exit(1)
+        return
+
+    page_hooks.update({key: config[key] for key in page_hooks if key in config})
+    snapshots.level = config.get('debug_snapshots', 'errors')
+    snapshots.ring = deque(maxlen=config.get('debug_snapshot_ring_size', 10))
+    # Set metrics_file to "" (and leave prometheus_textfile unset) to turn instrumentation off
+    metrics_file = config.get('metrics_file', 'metrics.json')
+    prometheus_textfile = config.get('prometheus_textfile')
+    metrics.json_path = os.path.join(config_dir, metrics_file) if metrics_file else None
+    metrics.prometheus_path = os.path.join(config_dir, prometheus_textfile) if prometheus_textfile else None
+    metrics.start()
+
+    if 'jobs' in config:
+        if args.daemon:
+            logger.error("--daemon runs a single playlist and cannot be combined with a \"jobs\" list.")
+            exit(1)
+        log_dir = config.get('log_dir', 'logs')
+        workers = args.jobs or config.get('parallel_jobs', 2)
+        if not run_jobs(jobs, workers, args.resume, args.rebuild_catalog, os.path.join(config_dir, log_dir) if log_dir else None):
+            exit(1)
+        return
+
+    job = jobs[0]
+    if args.daemon:
+        run_daemon(job, config.get('rotation_interval_minutes', 1440) * 60, args.resume)
+        return
+
+    run = select_photos(job, args.resume, args.rebuild_catalog)
+    if not run['image_files']:
+        logger.error(f"No image files found in '{job['photos_directory']}'.")
         exit(1)
-    logger.info(f"Found {len(image_files)} image files.")
+
+    # Get the photos most likely to be uploaded ready while the browser starts, logs in and clears the playlist
+    start_preparing(job, run)
+    phase_times = {'scan': time.time() - run_start_time}
     
-    driver = setup_webdriver()
+    phase_start_time = time.time()
+    driver = setup_webdriver(job['driver_cache_path'], job['chrome_profile_dir'], job['browser_memory_mb'],
+                             job['lean_browser'], job['lean_block_urls'], job['selenium_remote_url'])
+    phase_times['browser start'] = time.time() - phase_start_time
     
+    succeeded = False
     try:
-        if not login_to_nixplay(driver, base_url, username, password):
+        phase_start_time = time.time()
+        if not ensure_logged_in(driver, job, check_session=bool(job['chrome_profile_dir'])):
             logger.error("Login failed. Exiting.")
             exit(1)
+        phase_times['login'] = time.time() - phase_start_time
         
-        if not find_playlist(driver, base_url, playlist_name):
-            logger.error(f"Could not find playlist '{playlist_name}'. Exiting.")
-            exit(1)
-        
-        if not delete_all_photos(driver):
-            logger.error("Failed to delete existing photos. Continuing with upload...")
-        
-        if not upload_photos(driver, image_files, batch_size):
-            logger.error("Failed to upload photos.")
+        if not sync_playlist(driver, job, run, run_start_time, phase_times):
             exit(1)
         
+        succeeded = True
         logger.info("Nixplay photo upload completed successfully!")
     except Exception as e:
         logger.error(f"main() Exception: {str(e)}")
-        save_debug_snapshot(driver, "unexpected_error")
+        save_debug_snapshot(driver, "unexpected_error", error=True)
     finally:
         logger.debug("Closing WebDriver...")
         save_debug_snapshot(driver, "final_state_before_exit")
         driver.quit()
+        snapshots.flush()
+        metrics.write(succeeded)
 
 
 if __name__ == "__main__":
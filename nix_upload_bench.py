@@ -0,0 +1,176 @@
+"""Upload benchmark of "nix-upload.py bench": full playlist syncs against the local fake_nixplay server.
+
+The functions take the nix-upload module as app, so they measure the script's own upload code.
+"""
+import json
+import os
+import random
+import sys
+import time
+
+import fake_nixplay
+
+def run_benchmark(app, batch_sizes=(10, 25, 50), library_sizes=(100,), photo_kb=500, bandwidth_mbps=None, latency=0.0,
+                  failure_rate=0.0, transport='selenium', output_path=None, browsers=('normal',), delete_rate=None, remote_url=None):
+    """Time full playlist syncs against a local FakeNixplayServer, for every library size and batch size.
+
+    Generates a library of random photo_kb files, then per combination opens the playlist, deletes all
+    photos, uploads library_size photos in batches of batch_size and reloads the full playlist. Each
+    combination runs once per browser mode in browsers ('normal' and/or 'lean'), in a local Chrome or in the
+    one behind remote_url. Logs photos/s, MB/s, the time of each phase and the page load and memory footprint
+    of the browser, writes the results as JSON to output_path if given, and returns them. Every test photo
+    has its own name, so a name the playlist holds twice is a photo the retries uploaded twice; those are
+    counted in 'duplicates' and logged as errors.
+    """
+    import tempfile
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='nix-bench-') as library:
+        rng = random.Random(0)
+        paths = []
+        for index in range(max(library_sizes)):
+            path = os.path.join(library, f"bench_{index:05d}.jpg")
+            with open(path, 'wb') as f:
+                f.write(rng.randbytes(photo_kb * 1024))
+            paths.append(path)
+
+        server = fake_nixplay.FakeNixplayServer(bandwidth_mbps=bandwidth_mbps, latency=latency, failure_rate=failure_rate,
+                                                delete_rate=delete_rate)
+        playlist_name = next(iter(server.playlists.values()))['name']
+        base_url = server.start()
+        app.logger.info(f"Benchmarking against fake Nixplay at {base_url} (bandwidth {bandwidth_mbps or 'unlimited'} Mbit/s, "
+                    f"latency {latency * 1000:.0f}ms, failure rate {failure_rate:.0%}, delete rate {delete_rate or 'unlimited'} photos/s, "
+                    f"{transport} transport).")
+        try:
+            for browser in browsers:
+                if not benchmark_browser(app, server, base_url, playlist_name, paths, batch_sizes, library_sizes, photo_kb,
+                                         transport, browser, results, remote_url):
+                    break
+        finally:
+            server.stop()
+            app.snapshots.flush()
+
+    app.logger.info("Benchmark summary:")
+    app.logger.info(f"{'browser':>7} {'photos':>7} {'batch':>6} {'landed':>7} {'twice':>6} {'photos/s':>9} {'MB/s':>7} {'WebDriver calls':>16} "
+                f"{'page load s':>12} {'Chrome MB':>10}")
+    for result in results:
+        footprint = result['footprint']
+        app.logger.info(f"{result['browser']:>7} {result['library_size']:>7} {result['batch_size']:>6} {result['photos']:>7} {result['duplicates']:>6} "
+                    f"{result['photos_per_s']:>9.2f} {result['mb_per_s']:>7.2f} {result['webdriver_calls']:>16} "
+                    f"{app.format_measure(footprint['page_load_s'], '.2f'):>12} {app.format_measure(footprint['rss_mb'], '.0f'):>10}")
+    if 'normal' in browsers and 'lean' in browsers:
+        for key, label in (('page_load_s', 'playlist page load time'), ('rss_mb', 'Chrome memory')):
+            pairs = [(normal['footprint'][key], lean['footprint'][key])
+                     for normal in results if normal['browser'] == 'normal'
+                     for lean in results if lean['browser'] == 'lean'
+                     and (lean['library_size'], lean['batch_size']) == (normal['library_size'], normal['batch_size'])]
+            pairs = [(normal, lean) for normal, lean in pairs if normal and lean is not None]
+            if pairs:
+                reduction = 1 - sum(lean for _, lean in pairs) / sum(normal for normal, _ in pairs)
+                app.logger.info(f"Lean browser: {reduction:.0%} less {label} than the normal browser.")
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        app.logger.info(f"Benchmark results written to {output_path}")
+    return results
+
+
+def benchmark_browser(app, server, base_url, playlist_name, paths, batch_sizes, library_sizes, photo_kb, transport, browser, results,
+                      remote_url=None):
+    """Run the benchmark combinations in one browser (browser is 'normal' or 'lean'); returns False if it could not run."""
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    driver = None
+    try:
+        phase_start_time = time.time()
+        driver = app.setup_webdriver(lean=browser == 'lean', remote_url=remote_url)
+        startup = {'browser start': time.time() - phase_start_time}
+        # Count WebDriver round trips, the cost that batching commands in the page saves
+        commands = [0]
+        execute = driver.execute
+        def counting_execute(*args, **kwargs):
+            commands[0] += 1
+            return execute(*args, **kwargs)
+        driver.execute = counting_execute
+
+        phase_start_time = time.time()
+        if not app.login_to_nixplay(driver, base_url, server.username, server.password):
+            app.logger.error("Could not log in to the fake Nixplay.")
+            return False
+        startup['login'] = time.time() - phase_start_time
+
+        for library_size in library_sizes:
+            for batch_size in batch_sizes:
+                files = paths[:library_size]
+                phases = dict(startup)
+                commands[0] = 0
+
+                phase_start_time = time.time()
+                if not app.find_playlist(driver, base_url, playlist_name):
+                    app.logger.error("Could not open the fake playlist.")
+                    return False
+                phases['find playlist'] = time.time() - phase_start_time
+
+                phase_start_time = time.time()
+                if not app.delete_all_photos(driver) or server.photo_names(playlist_name):
+                    app.logger.warning("The fake playlist was not emptied before uploading.")
+                phases['delete'] = time.time() - phase_start_time
+
+                phase_start_time = time.time()
+                if transport == 'http':
+                    session = app.http_session_from_driver(driver, 4)
+                    upload_url = fake_nixplay.FAKE_HTTP_UPLOAD_URL.format(base_url=base_url, playlist_id=app.get_playlist_id(driver))
+                    app.upload_photos_http(session, upload_url, files, batch_size, 4)
+                else:
+                    app.upload_photos(driver, files, batch_size, remote_url=remote_url)
+                upload_seconds = time.time() - phase_start_time
+                phases['upload'] = upload_seconds
+                names = server.photo_names(playlist_name)
+                landed = len(set(names))
+                duplicates = len(names) - landed
+                if duplicates:
+                    app.logger.error(f"{duplicates} photos were uploaded more than once, e.g. '{next(name for name in names if names.count(name) > 1)}'.")
+                upload_calls = commands[0]
+
+                # Load the full playlist again, thumbnails and all, to measure what the browser has to take in
+                phase_start_time = time.time()
+                driver.refresh()
+                WebDriverWait(driver, 120).until(lambda d: d.execute_script("return document.readyState;") == 'complete'
+                                                 and app.page_state(d)['photoCount'] >= landed)
+                phases['reload playlist'] = time.time() - phase_start_time
+                footprint = app.browser_footprint(driver)
+
+                megabytes = landed * photo_kb / 1024
+                result = {
+                    'browser': browser,
+                    'library_size': library_size,
+                    'batch_size': batch_size,
+                    'photos': landed,
+                    'duplicates': duplicates,
+                    'photos_per_s': landed / upload_seconds,
+                    'mb_per_s': megabytes / upload_seconds,
+                    'webdriver_calls': upload_calls,
+                    'phases': phases,
+                    'footprint': footprint,
+                    'python_peak_rss_mb': python_peak_rss_mb(),
+                }
+                results.append(result)
+                app.logger.info(f"{browser} browser, {library_size} photos in batches of {batch_size}: {landed} landed, "
+                            f"{result['photos_per_s']:.2f} photos/s, {result['mb_per_s']:.2f} MB/s, {upload_calls} WebDriver calls ("
+                            + ", ".join(f"{phase} {seconds:.1f}s" for phase, seconds in phases.items()) + "), "
+                            + app.describe_footprint(footprint) + f", Python peak {app.format_measure(result['python_peak_rss_mb'], '.0f', ' MB')}.")
+        return True
+    finally:
+        if driver is not None:
+            driver.quit()
+
+
+def python_peak_rss_mb():
+    """Peak resident memory of this Python process so far, or None where the platform does not report it."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)